@@ -1,10 +1,34 @@
 #!/usr/bin/env python
 
+from array import array
+from collections import OrderedDict
 from decimal import Decimal
+from StringIO import StringIO
+import BaseHTTPServer
+import errno
+import json
+import os
+import socket
+import SocketServer
+import stat
+import sys
+import threading
+import time
+import traceback
+import urllib2
 
 from eu4.eu_map import terrain_txt
 from eu4.terrain import province_terrain, terrain_overrides
-from eu4.history import countries, provinces
+from eu4.history import load_countries, load_provinces
+from eu4.province_table import ProvinceTable
+from eu4.store import open_store
+from eu4.timeline import (
+    Timeline,
+    load_country_timelines,
+    load_province_timelines,
+    parse_date,
+    sweep,
+)
 
 from eu4.ideas import (
     custom_ideas,
@@ -12,9 +36,12 @@ from eu4.ideas import (
     national_ideas,
     get_idea_cost,
     get_ideas_for_tag,
+    resolve_all_tags,
     IDEA_COST_PROGRESSION,
     IDEA_SLOTS,
 )
+from lib.lazy import timings
+from lib.nom import sharing
 
 IDEA_COSTS_FMT = "{!s}: {:>36} {:>6}({:6.2f}) {:>6.2f}"
 LINE = '-' * 79
@@ -71,6 +98,18 @@ class Countries(object):
         'shogunate': 50,
     }
 
+    # the only history fields used, everything else is skipped while parsing
+    PROVINCE_FIELDS = (
+        'base_tax',
+        'base_production',
+        'base_manpower',
+        'trade_goods',
+        'owner',
+        'hre',
+        'extra_cost',
+    )
+    COUNTRY_FIELDS = ('capital',)
+
     TECH_GROUPS = {
         'europe': 'western',
         'africa':  'muslim',
@@ -88,15 +127,44 @@ class Countries(object):
     def _get_heir_cost(a, d, m, age):
         return (a + d + m - 6) * 60/(age + 15)
 
-    def __init__(self):
-        self._terrain = {}
+    def __init__(self, date=None):
+        """
+        Uses the history in effect on date, e.g. '1444.11.11', if given and the
+        undated values otherwise.
+        """
+        self._date = date
         self._capitals = {}
+        self._capital_owners = {}
+        # owner: OrderedDict of table rows, used as a set; rows are listed in
+        # table order
         self._owners = {}
-        self._province_base_costs = {}
+        self._hre = {}
+        # owner: (total as in stats_for_owner, total as in print_stats)
+        self._owner_totals = {}
+        store = open_store() if date is None else None
+        if store and store.fresh('provinces') and store.fresh('countries'):
+            provinces = store.history('provinces', self.PROVINCE_FIELDS)
+            self._countries = store.history('countries', self.COUNTRY_FIELDS)
+        elif date is None:
+            provinces = load_provinces(self.PROVINCE_FIELDS)
+            self._countries = load_countries(self.COUNTRY_FIELDS)
+        else:
+            provinces = dict(
+                (k, v.state(date)) for k, v in
+                load_province_timelines(self.PROVINCE_FIELDS).iteritems())
+            self._countries = dict(
+                (k, v.state(date)) for k, v in
+                load_country_timelines(self.COUNTRY_FIELDS).iteritems())
+        if store:
+            store.close()
+        self._table = ProvinceTable(provinces, self._load_terrain())
+        # by table row, only meaningful for owned provinces
+        self._base_costs = array('d', [0.0]) * len(self._table)
+        self._extra_costs = array('i', [0]) * len(self._table)
 
-        self._load_terrain()
         self._load_capitals()
         self._load_provinces()
+        self._load_totals()
 
     def _load_terrain(self):
         TEST_TERRAIN = {
@@ -114,88 +182,254 @@ class Countries(object):
             142: 'coastline',
         }
 
+        terrain = {}
         for k, v in province_terrain.iteritems():
-            self._terrain[k] = v
+            terrain[k] = v
         for k, v in terrain_overrides.iteritems():
-            self._terrain[k] = v
+            terrain[k] = v
 
         for k in TEST_TERRAIN.keys():
-            assert(TEST_TERRAIN[k] == self._terrain[k])
+            assert(TEST_TERRAIN[k] == terrain[k])
+
+        return terrain
 
     def _load_capitals(self):
-        for tag, data in countries.iteritems():
-            try:
-                self._capitals[tag] = data['capital']
-            except KeyError:
-                pass
+        for tag in self._countries.keys():
+            self._load_capital(tag)
 
-    def _base_cost(self, province_id):
-        data = provinces[province_id]
+    def _load_capital(self, tag):
+        try:
+            self._capitals[tag] = self._countries[tag]['capital']
+        except KeyError:
+            return
+        try:
+            capital = int(self._capitals[tag])
+        except ValueError:
+            return
+        self._capital_owners.setdefault(capital, set()).add(tag)
+
+    def _unload_capital(self, tag):
+        try:
+            capital = int(self._capitals.pop(tag))
+        except (KeyError, ValueError):
+            return
+        self._capital_owners[capital].discard(tag)
+
+    def _base_cost(self, row):
+        t = self._table
+        if t.terrain[row] < 0:
+            raise KeyError(t.ids[row])
+        terrain = t.terrain_names[t.terrain[row]]
 
         return (
-            int(data['base_tax']) +
-            int(data['base_production']) +
-            int(data['base_manpower'])
-        ) * 0.5 * self.TERRAIN_MULTIPLIERS[self._terrain[province_id]]
-
-    def _extra_cost(self, province_id):
-        cost = 0
-        data = provinces[province_id]
-        if data['trade_goods'] == 'gold':
-            cost += self.GOLD_MULTIPLIER * int(data['base_production'])
-        if 'extra_cost' in data.keys():
-            cost += int(data['extra_cost'])
+            t.base_tax[row] +
+            t.base_production[row] +
+            t.base_manpower[row]
+        ) * 0.5 * self.TERRAIN_MULTIPLIERS[terrain]
+
+    def _extra_cost(self, row):
+        t = self._table
+        cost = t.extra_cost[row]
+        gold = t.code_of('trade_goods', 'gold')
+        if gold is not None and t.trade_goods[row] == gold:
+            cost += self.GOLD_MULTIPLIER * t.base_production[row]
 
         return cost
 
     def _load_provinces(self):
-        for province_id in provinces.keys():
-            self._load_province(province_id)
-
-    def _load_province(self, province_id):
-        data = provinces[province_id]
-
-        if 'owner' not in data.keys():
-            return
-
-        owner = data['owner']
+        for owner, rows in self._table.group_by('owner').iteritems():
+            if owner is None:
+                continue
+            self._owners[owner] = OrderedDict.fromkeys(rows)
+            for row in rows:
+                self._load_province(row)
+
+    def _load_province(self, row):
+        self._base_costs[row] = self._base_cost(row)
+        self._extra_costs[row] = self._extra_cost(row)
+
+    def _load_totals(self):
+        for owner in self._owners.keys():
+            self._load_owner_totals(owner)
+
+    def _load_owner_totals(self, owner):
+        # summed in the same order as the reports always have been
+        hre = self._is_hre(owner)
+        self._hre[owner] = hre
+        hre_mult = self.HRE_CAPITAL_MULT if hre else 1.0
+        total = self.HRE_CAPITAL_COST if hre else 0
+        flat_total = 0
+        for row in sorted(self._owners[owner]):
+            cost = self._base_costs[row] * hre_mult
+            extra = self._extra_costs[row]
+            total += cost + extra
+            flat_total += cost
+            flat_total += extra
+        self._owner_totals[owner] = (total, flat_total)
+
+    def _province_cost(self, row, owner):
+        hre_mult = self.HRE_CAPITAL_MULT if self._hre[owner] else 1.0
+        return self._base_costs[row] * hre_mult + self._extra_costs[row]
+
+    def _remove_province(self, row, owner):
+        cost = self._province_cost(row, owner)
+        total, flat_total = self._owner_totals[owner]
+        self._owner_totals[owner] = (total - cost, flat_total - cost)
+        del self._owners[owner][row]
+        if not self._owners[owner]:
+            del self._owners[owner]
+            del self._owner_totals[owner]
+            del self._hre[owner]
+
+    def _add_province(self, row, owner):
+        if owner not in self._owners:
+            self._owners[owner] = OrderedDict()
+            self._load_owner_totals(owner)
+        self._owners[owner][row] = None
+        self._load_province(row)
+        cost = self._province_cost(row, owner)
+        total, flat_total = self._owner_totals[owner]
+        self._owner_totals[owner] = (total + cost, flat_total + cost)
+
+    def update_province(self, province_id, **values):
+        """
+        Changes history values of a province, e.g. owner='swe' or
+        base_tax='5' (None removes a value), adjusting only the totals of the
+        owners involved rather than recomputing everything. Changing the hre
+        value of a capital recomputes the totals of the owners of that
+        capital.
+        """
+        row = self._table.row_of(province_id)
+        old_owner = self._table.value(row, 'owner')
+        if old_owner is not None:
+            self._remove_province(row, old_owner)
+
+        for k, v in values.iteritems():
+            if k == 'owner' and v is not None:
+                v = v.lower()
+            self._table.set_value(row, k, v)
+
+        owner = self._table.value(row, 'owner')
+        if owner is not None:
+            self._add_province(row, owner)
+
+        if 'hre' in values:
+            for capital_owner in self._capital_owners.get(province_id, ()):
+                if capital_owner in self._owners:
+                    self._load_owner_totals(capital_owner)
+
+    def update_country(self, tag, **values):
+        """
+        Changes history values of a country, e.g. capital='1', recomputing the
+        totals of the country if it owns provinces.
+        """
+        self._unload_capital(tag)
+        data = self._countries.setdefault(tag, {})
+        for k, v in values.iteritems():
+            if v is None:
+                data.pop(k, None)
+            else:
+                data[k] = v
+        self._load_capital(tag)
+
+        if tag in self._owners:
+            self._load_owner_totals(tag)
+
+    def snapshots(self, dates):
+        """
+        Replays dated province and country history once, forwards from the
+        undated values, yielding (date, totals()) for each of dates in date
+        order as it is reached. The changes are applied to this instance.
+        """
+        if self._date is not None:
+            raise ValueError("snapshots replay from the undated history")
+        groups = (
+            ('province', load_province_timelines(self.PROVINCE_FIELDS)),
+            ('country', load_country_timelines(self.COUNTRY_FIELDS)),
+        )
+        for date, changes in sweep(dates, *groups):
+            for kind, key, field, value in changes:
+                if kind == 'province':
+                    self.update_province(key, **{field: value})
+                else:
+                    self.update_country(key, **{field: value})
+            yield date, self.totals()
+
+    def print_snapshots(self, dates):
+        for date, totals in self.snapshots(dates):
+            date = '.'.join(str(part) for part in date)
+            for owner in sorted(totals.keys()):
+                print date, owner, totals[owner]
+            sys.stdout.flush()
+
+    def reload_province(self, province_id, history):
+        """
+        Applies the full history of a province as parsed from its changed
+        file, None if the file was removed.
+        """
+        state = Timeline(
+            history or {}, self.PROVINCE_FIELDS, lower=('owner',)
+        ).state(self._date)
         try:
-            self._owners[owner].append(province_id)
+            self._table.row_of(province_id)
         except KeyError:
-            self._owners[owner] = [ province_id ]
-        self._province_base_costs[province_id] = self._base_cost(province_id)
+            terrain = terrain_overrides.get(
+                province_id, province_terrain.get(province_id))
+            self._table.append(province_id, {}, terrain)
+            self._base_costs.append(0.0)
+            self._extra_costs.append(0)
+        self.update_province(province_id, **dict(
+            (k, state.get(k)) for k in self.PROVINCE_FIELDS))
+
+    def reload_country(self, tag, history):
+        """
+        Applies the full history of a country as parsed from its changed file,
+        None if the file was removed.
+        """
+        state = Timeline(history or {}, self.COUNTRY_FIELDS).state(self._date)
+        self.update_country(tag, **dict(
+            (k, state.get(k)) for k in self.COUNTRY_FIELDS))
 
     def _is_hre(self, owner):
         try:
-            capital = provinces[int(countries[owner]['capital'])]
-            return (capital['hre'] == 'yes')
+            capital = self._table.row_of(int(self._countries[owner]['capital']))
         except KeyError:
             return False
+        return bool(self._table.hre[capital])
 
     def owners(self):
         return self._owners.keys()
 
-    def stats_for_owner(self, owner):
-        results = { 'total': 0, 'provinces': [] }
+    def totals(self):
+        """
+        Returns {owner: total} for every owner, as in stats_for_owner.
+        """
+        return dict((k, v[0]) for k, v in self._owner_totals.iteritems())
 
-        # HRE
-        hre_mult = 1.0
-        if self._is_hre(owner):
-            results['total'] += 20
-            hre_mult = self.HRE_CAPITAL_MULT
+    def stats_for_owner(self, owner):
+        results = { 'total': self._owner_totals[owner][0], 'provinces': [] }
 
-        for province_id in self._owners[owner]:
-            cost = self._province_base_costs[province_id] * hre_mult
-            cost += self._extra_cost(province_id)
-            results['provinces'].append( (province_id, cost) )
-            results['total'] += cost
+        for row in sorted(self._owners[owner]):
+            cost = self._province_cost(row, owner)
+            results['provinces'].append( (self._table.ids[row], cost) )
 
         return results
 
+    def province_costs(self):
+        """
+        Returns {province id: cost} for every owned province, assuming a
+        non-HRE capital.
+        """
+        costs = {}
+        for row in self._table.where():
+            if self._table.owner[row] >= 0:
+                costs[self._table.ids[row]] = (
+                    self._base_costs[row] + self._extra_costs[row])
+        return costs
+
     def print_stats_per_province(self):
         inverted = {}
-        for k, v in self._province_base_costs.iteritems():
-            v += self._extra_cost(k)
+        for k, v in self.province_costs().iteritems():
             try:
                 inverted[v].append(k)
             except KeyError:
@@ -209,12 +443,7 @@ class Countries(object):
     def print_stats(self):
         costs = {}
 
-        for owner, provs in self._owners.iteritems():
-            cost = 0
-            hre_mult = 1.0 if not self._is_hre(owner) else self.HRE_CAPITAL_MULT
-            for province_id in provs:
-                cost += self._province_base_costs[province_id] * hre_mult
-                cost += self._extra_cost(province_id)
+        for owner, (total, cost) in self._owner_totals.iteritems():
             try:
                 costs[cost].append(owner)
             except KeyError:
@@ -234,6 +463,10 @@ class Countries(object):
         print 'Total', stats['total']
 
 class Ideas(object):
+    def __init__(self):
+        self._bonus_costs = {}
+        self._stats = None
+
     @staticmethod
     def get_level_and_cost(slot, bonus, magnitude):
         multiplier = IDEA_COST_PROGRESSION[slot]
@@ -250,25 +483,83 @@ class Ideas(object):
         cost = float(get_idea_cost(idea, level)) * multiplier
         return (level if not was_missing else -1, cost)
 
-    def stats_for_ideas(self, ideas):
-        result = {
+    def _bonus_cost(self, bonus, magnitude):
+        """
+        Returns (level, unscaled cost, exceeds max level) for a bonus, computed
+        once per bonus and magnitude. The cost is None for undefined bonuses.
+        """
+        key = (bonus, magnitude)
+        try:
+            return self._bonus_costs[key]
+        except KeyError:
+            pass
+
+        was_missing = True
+        try:
+            idea = custom_ideas[bonus]
+            was_missing = False
+        except KeyError:
+            idea = missing_ideas.get(bonus)
+        if idea is None:
+            result = (-1, None, False)
+        else:
+            level = Decimal(magnitude) / Decimal(idea['magnitude'])
+            cost = float(get_idea_cost(idea, level))
+            if was_missing:
+                result = (-1, cost, False)
+            else:
+                result = (level, cost, level >= 0 and level > idea['max_level'])
+        self._bonus_costs[key] = result
+        return result
+
+    def reload(self):
+        """
+        Forgets computed costs after idea files changed.
+        """
+        self._bonus_costs = {}
+        self._stats = None
+
+    @staticmethod
+    def _new_stats():
+        return {
             'total': 0, 'ideas': [], 'ideas_count': 0,
             'values_missing': False, 'values_exceed_max': False
         }
 
+    def _add_idea(self, result, slot, k, v):
+        level, cost, exceeds_max = self._bonus_cost(k, v)
+        # same as get_level_and_cost, which scales the float cost by slot
+        cost = 0 if cost is None else cost * IDEA_COST_PROGRESSION[slot]
+        result['ideas'].append( (slot, k, v, level, cost) )
+        result['total'] += cost
+        result['ideas_count'] += 1
+        if level < 0:
+            result['values_missing'] = True
+        elif exceeds_max:
+            result['values_exceed_max'] = True
+
+    def stats_for_ideas(self, ideas):
+        result = self._new_stats()
+
         for slot in IDEA_SLOTS:
             for k, v in ideas[slot]:
-                level, cost = self.get_level_and_cost(slot, k, v)
-                result['ideas'].append( (slot, k, v, level, cost) )
-                result['total'] += cost
-                result['ideas_count'] += 1
-                if level < 0:
-                    result['values_missing'] = True
-                elif level > custom_ideas[k]['max_level']:
-                    result['values_exceed_max'] = True
+                self._add_idea(result, slot, k, v)
 
         return result
 
+    def stats_for_all(self):
+        """
+        Returns stats_for_ideas for every national idea group, keyed by group
+        name. There is no separate batch pass: the cost of each bonus and
+        magnitude is computed once in _bonus_cost and reused by every group.
+        """
+        if self._stats is None:
+            self._stats = OrderedDict(
+                (name, self.stats_for_ideas(ideas))
+                for name, ideas in national_ideas.iteritems()
+            )
+        return self._stats
+
     def print_legend(self):
         print "Legend:"
         print "\t> Has more than 10 ideas."
@@ -300,8 +591,7 @@ class Ideas(object):
 
     def print_stats(self):
         costs = {}
-        for tag, ideas in national_ideas.iteritems():
-            stats = self.stats_for_ideas(ideas)
+        for tag, stats in self.stats_for_all().iteritems():
             if stats['values_exceed_max']:
                 tag += '+'
             if stats['values_missing']:
@@ -318,30 +608,20 @@ class Ideas(object):
         for total in sorted(costs.keys()):
             print "%.2f %s" % (total, ' '.join(costs[total]))
 
-def main():
-    import argparse
-    p = argparse.ArgumentParser(
-        description="Prints costs for a tag or idea cost stats if not specified."
-    )
-    p.add_argument('--dryrun', '-n', action='store_true', help="dry run")
-    p.add_argument('--ideas', '-i', action='store_true', help="idea costs only")
-    p.add_argument('--provinces', '-p', action='store_true', help="province costs only")
-    p.add_argument('tag', nargs='?', help="tag or group name")
-    options = p.parse_args()
-
-    i = None
-    if not options.provinces:
-        i = Ideas()
-
-    c = None
-    if not options.ideas:
-        c = Countries()
-
-    if options.dryrun:
-        return
-
-    if options.tag != None:
-        tag = options.tag.lower()
+def print_timings():
+    for name, seconds in timings:
+        print >> sys.stderr, '%8.3fs %s' % (seconds, name)
+    for name, stats in sharing:
+        print >> sys.stderr, '%d of %d subtrees shared (%dkB) in %s' % (
+            stats['shared'], stats['subtrees'], stats['saved'] >> 10, name)
+
+def report(i, c, tag=None):
+    """
+    Prints the costs for tag, or for every owner if not given, from Ideas i
+    and/or Countries c.
+    """
+    if tag != None:
+        tag = tag.lower()
         if i:
             i.print_stats_for_tag(tag)
         if i and c:
@@ -356,9 +636,12 @@ def main():
             c.print_stats()
         else:
             totals = {}
+            tag_ideas = resolve_all_tags(c.owners())
+            group_stats = i.stats_for_all()
+            owner_totals = c.totals()
             for owner in c.owners():
-                ideas_stats = i.stats_for_ideas(get_ideas_for_tag(owner)[1])
-                cost = c.stats_for_owner(owner)['total']
+                ideas_stats = group_stats[tag_ideas[owner][0]]
+                cost = owner_totals[owner]
                 cost += ideas_stats['total']
                 flags = i.get_flags(ideas_stats)
                 try:
@@ -368,5 +651,308 @@ def main():
             for key in sorted(totals.keys()):
                 print key, ', '.join(totals[key])
 
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+class CostServer(object):
+    """
+    Answers JSON requests such as {"method": "tag", "tag": "swe"} from Ideas
+    and Countries loaded once. A list of requests gets a list of responses.
+    Each response is {"result": ...} or {"error": message}.
+    """
+    METHODS = ('tag', 'owners', 'provinces', 'report')
+
+    def __init__(self, i, c):
+        self.ideas = i
+        self.countries = c
+        # taken by requests and reloads; report also has stdout to itself
+        self._lock = threading.RLock()
+
+    def handle(self, request):
+        if isinstance(request, list):
+            return [self.handle(r) for r in request]
+        try:
+            method = request['method']
+            if method not in self.METHODS:
+                raise ValueError("unknown method: %s" % method)
+            args = dict(
+                (str(k), v) for k, v in request.iteritems() if k != 'method')
+            with self._lock:
+                return { 'result': getattr(self, method)(**args) }
+        except Exception as e:
+            return { 'error': '%s: %s' % (type(e).__name__, e) }
+
+    def handle_json(self, text):
+        try:
+            request = json.loads(text)
+        except ValueError as e:
+            response = { 'error': 'ValueError: %s' % e }
+        else:
+            response = self.handle(request)
+        return json.dumps(response, default=_json_default)
+
+    def tag(self, tag):
+        """
+        Idea stats and province costs of a tag, provinces null if it owns
+        none.
+        """
+        tag = str(tag).lower()
+        name, ideas = get_ideas_for_tag(tag)
+        stats = dict(self.ideas.stats_for_ideas(ideas), name=name)
+        try:
+            provinces = self.countries.stats_for_owner(tag)
+        except KeyError:
+            provinces = None
+        return { 'ideas': stats, 'provinces': provinces }
+
+    def owners(self):
+        """
+        Province, idea and total costs with idea flags of every owner.
+        """
+        tag_ideas = resolve_all_tags(self.countries.owners())
+        group_stats = self.ideas.stats_for_all()
+        result = {}
+        for owner, cost in self.countries.totals().iteritems():
+            ideas_stats = group_stats[tag_ideas[owner][0]]
+            result[owner] = {
+                'provinces': cost,
+                'ideas': ideas_stats['total'],
+                'total': cost + ideas_stats['total'],
+                'flags': self.ideas.get_flags(ideas_stats),
+            }
+        return result
+
+    def provinces(self):
+        return self.countries.province_costs()
+
+    def report(self, tag=None, ideas=False, provinces=False):
+        """
+        The text costs.py prints for the same arguments.
+        """
+        if tag is not None:
+            tag = str(tag)
+        out = StringIO()
+        with self._lock:
+            stdout, sys.stdout = sys.stdout, out
+            try:
+                report(None if provinces else self.ideas,
+                       None if ideas else self.countries, tag)
+            finally:
+                sys.stdout = stdout
+        return out.getvalue()
+
+    def apply(self, changes):
+        """
+        Applies (dataset, key, value) changes from eu4.watch.Watcher.poll.
+        """
+        with self._lock:
+            for name, key, value in changes:
+                if name == 'provinces' and key is not None:
+                    self.countries.reload_province(key, value)
+                elif name == 'countries' and key is not None:
+                    self.countries.reload_country(key, value)
+                elif name in ('national_ideas', 'custom_ideas'):
+                    self.ideas.reload()
+                elif name in ('provinces', 'countries', 'terrain',
+                              'terrain_overrides', 'definition'):
+                    self.countries = Countries(self.countries._date)
+
+    def watch(self, interval):
+        """
+        Applies changes to the game files every interval seconds, forever.
+        Polling patches and drops the datasets requests read, so it takes the
+        lock too.
+        """
+        from eu4.watch import Watcher
+        watcher = Watcher()
+        while True:
+            try:
+                with self._lock:
+                    changes = watcher.poll()
+                    if changes:
+                        self.apply(changes)
+            except Exception:
+                # keep watching, a later edit may fix the file
+                traceback.print_exc()
+            time.sleep(interval)
+
+def _is_http(address):
+    # host:port, anything else is the path of a Unix socket
+    return ':' in address and '/' not in address
+
+class _UnixHandler(SocketServer.StreamRequestHandler):
+    # one JSON request per line, answered by one JSON line
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            self.wfile.write(self.server.costs.handle_json(line) + '\n')
+            self.wfile.flush()
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class _HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # POST a JSON request, get the JSON response
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.server.costs.handle_json(self.rfile.read(length))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def _remove_stale_socket(address):
+    """
+    Removes the socket of a server that is gone from address. Exits if
+    anything else is there, or if a server still answers on it.
+    """
+    try:
+        mode = os.stat(address).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        sys.exit("%s exists and is not a socket" % address)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except socket.error as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        os.remove(address)
+        return
+    finally:
+        sock.close()
+    sys.exit("a server is already listening on %s" % address)
+
+def serve(address, i, c, watch=None):
+    """
+    Serves CostServer requests on a Unix socket path or an HTTP host:port
+    until interrupted, applying changes to the game files every watch seconds
+    if given.
+    """
+    if _is_http(address):
+        host, port = address.rsplit(':', 1)
+        server = _HTTPServer((host, int(port)), _HTTPHandler)
+    else:
+        _remove_stale_socket(address)
+        server = _UnixServer(address, _UnixHandler)
+    server.costs = CostServer(i, c)
+    if watch:
+        watcher = threading.Thread(target=server.costs.watch, args=(watch,))
+        watcher.daemon = True
+        watcher.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not _is_http(address):
+            os.remove(address)
+
+def request(address, request):
+    """
+    Sends a request to a server started with costs.py --serve and returns
+    its response.
+    """
+    data = json.dumps(request)
+    if _is_http(address):
+        f = urllib2.urlopen(urllib2.Request(
+            'http://%s/' % address, data,
+            { 'Content-Type': 'application/json' }))
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        sock.sendall(data + '\n')
+        return json.loads(sock.makefile('rb').readline())
+    finally:
+        sock.close()
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(
+        description="Prints costs for a tag or idea cost stats if not specified."
+    )
+    p.add_argument('--dryrun', '-n', action='store_true', help="dry run")
+    p.add_argument('--ideas', '-i', action='store_true', help="idea costs only")
+    p.add_argument('--provinces', '-p', action='store_true', help="province costs only")
+    p.add_argument('--timings', '-t', action='store_true',
+                   help="print how long each dataset took to load, and how "
+                        "many subtrees were shared, to stderr")
+    p.add_argument('--date', '-d',
+                   help="price provinces as of a history date, e.g. 1444.11.11")
+    p.add_argument('--snapshots', '-s', nargs='+', metavar='DATE',
+                   help="print province costs per owner at each date, "
+                        "replaying history once")
+    p.add_argument('--serve', metavar='ADDRESS',
+                   help="load once and answer JSON requests on a Unix socket "
+                        "path or an HTTP host:port")
+    p.add_argument('--watch', '-w', type=float, metavar='SECONDS',
+                   help="with --serve, poll the game files for changes")
+    p.add_argument('--connect', '-c', metavar='ADDRESS',
+                   help="ask a server started with --serve instead of loading")
+    p.add_argument('tag', nargs='?', help="tag or group name")
+    options = p.parse_args()
+    if options.date is not None and parse_date(options.date) is None:
+        p.error("invalid date: %s" % options.date)
+    for date in options.snapshots or ():
+        if parse_date(date) is None:
+            p.error("invalid date: %s" % date)
+    if options.snapshots and options.date is not None:
+        p.error("--snapshots replays from the undated history, drop --date")
+    if options.connect and (options.snapshots or options.date or options.serve):
+        p.error("--connect uses the server's data, drop --snapshots, "
+                "--date and --serve")
+
+    if options.connect:
+        response = request(options.connect, {
+            'method': 'report', 'tag': options.tag,
+            'ideas': options.ideas, 'provinces': options.provinces })
+        if 'error' in response:
+            sys.exit(response['error'])
+        sys.stdout.write(response['result'].encode('utf-8'))
+        return
+
+    if options.timings:
+        import atexit
+        atexit.register(print_timings)
+
+    i = None
+    if not options.provinces:
+        i = Ideas()
+
+    c = None
+    if not options.ideas:
+        c = Countries(options.date)
+
+    if options.dryrun:
+        return
+
+    if options.serve:
+        serve(options.serve, i or Ideas(), c or Countries(options.date),
+              options.watch)
+
+    elif options.snapshots:
+        if not c:
+            c = Countries()
+        c.print_snapshots(options.snapshots)
+
+    else:
+        report(i, c, options.tag)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,127 @@
+from collections import deque
+from os.path import join
+
+import numpy
+
+from eu4.config import map_path
+from eu4.pixels import load_id_raster
+from lib.lazy import Lazy
+from lib.memoize import pickled
+
+__all__ = [ 'AdjacencyGraph', 'adjacency' ]
+
+_bitmaps = [join(map_path, fn) for fn in ('provinces.bmp', 'definition.csv')]
+
+def _border_pairs(a, b):
+    """
+    Returns the distinct (low id, high id) pairs, packed into int64, of
+    pixels in a and b at the same position whose ids differ.
+    """
+    differ = a != b
+    a = a[differ].astype(numpy.int64)
+    b = b[differ].astype(numpy.int64)
+    return numpy.unique((numpy.minimum(a, b) << 32) | numpy.maximum(a, b))
+
+class AdjacencyGraph(object):
+    """
+    Provinces sharing a pixel edge on the province map, in CSR form: the
+    neighbours of ids[i] are ids[neighbours[offsets[i]:offsets[i + 1]]].
+    """
+
+    def __init__(self, raster):
+        self.ids = numpy.unique(raster)
+        pairs = numpy.union1d(
+            _border_pairs(raster[:, 1:], raster[:, :-1]),
+            _border_pairs(raster[1:, :], raster[:-1, :]))
+        low = numpy.searchsorted(self.ids, pairs >> 32)
+        high = numpy.searchsorted(self.ids, pairs & 0xffffffff)
+
+        # both directions of every edge, sorted by source
+        sources = numpy.concatenate((low, high))
+        targets = numpy.concatenate((high, low))
+        order = numpy.lexsort((targets, sources))
+        self.neighbours = targets[order].astype(numpy.int32)
+        self.offsets = numpy.searchsorted(
+            sources[order], numpy.arange(len(self.ids) + 1)).astype(numpy.int64)
+        self._lists = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lists'] = None
+        return state
+
+    def _adjacency_lists(self):
+        if self._lists is None:
+            neighbours = self.neighbours.tolist()
+            offsets = self.offsets.tolist()
+            self._lists = [
+                neighbours[offsets[i]:offsets[i + 1]]
+                for i in xrange(len(self.ids))]
+        return self._lists
+
+    def index_of(self, province_id):
+        i = numpy.searchsorted(self.ids, province_id)
+        if i >= len(self.ids) or self.ids[i] != province_id:
+            raise KeyError(province_id)
+        return int(i)
+
+    def neighbours_of(self, province_id):
+        i = self.index_of(province_id)
+        return [
+            int(self.ids[j])
+            for j in self.neighbours[self.offsets[i]:self.offsets[i + 1]]]
+
+    def distances(self, province_id, max_distance=None):
+        """
+        Returns an array of the number of steps from province_id to every
+        province in ids, -1 where unreachable (or further than max_distance).
+        """
+        lists = self._adjacency_lists()
+        result = [-1] * len(self.ids)
+        start = self.index_of(province_id)
+        result[start] = 0
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            distance = result[i] + 1
+            if max_distance is not None and distance > max_distance:
+                continue
+            for j in lists[i]:
+                if result[j] < 0:
+                    result[j] = distance
+                    queue.append(j)
+        return numpy.array(result, dtype=numpy.int32)
+
+    def distance(self, source, target):
+        """
+        Returns the number of steps from source to target, None if there is no
+        path.
+        """
+        lists = self._adjacency_lists()
+        start, end = self.index_of(source), self.index_of(target)
+        seen = {start: 0}
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            if i == end:
+                return seen[i]
+            for j in lists[i]:
+                if j not in seen:
+                    seen[j] = seen[i] + 1
+                    queue.append(j)
+        return None
+
+    def within(self, province_id, max_distance):
+        """
+        Returns {province id: distance} for every province at most max_distance
+        steps away, including province_id itself.
+        """
+        distances = self.distances(province_id, max_distance)
+        found = numpy.flatnonzero(distances >= 0)
+        return dict(zip(self.ids[found].tolist(), distances[found].tolist()))
+
+@pickled(inputs=_bitmaps)
+def _load_adjacency():
+    return AdjacencyGraph(load_id_raster())
+
+adjacency = Lazy(_load_adjacency)
@@ -2,13 +2,14 @@ from glob import iglob
 from os.path import join, split, basename
 
 from eu4.config import common_path
-from lib.nom import nom
+from eu4.store import stored
+from lib.lazy import Lazy
+from lib.nom import nom_file
 
 __all__ = [ 'cultures', 'culture_map', 'religions', 'religion_map', 'governments' ]
 
 def _load(*args):
-    with open(join(common_path, *args), 'r') as f:
-        return nom(f.read())
+    return nom_file(join(common_path, *args))
 
 def _reverse_map(dictionary):
     result = {}
@@ -27,8 +28,11 @@ def _reverse_map(dictionary):
 
     return result
 
-cultures = _load('cultures', '00_cultures.txt')
-culture_map = _reverse_map(cultures)
-religions = _load('religions', '00_religion.txt')
-religion_map = _reverse_map(religions)
-governments = _load('governments', '00_governments.txt')
+def _stored(name, *args):
+    return stored(name, [join(common_path, *args)], _load, *args)
+
+cultures = Lazy(_stored('cultures', 'cultures', '00_cultures.txt'))
+culture_map = Lazy(_reverse_map, cultures)
+religions = Lazy(_stored('religions', 'religions', '00_religion.txt'))
+religion_map = Lazy(_reverse_map, religions)
+governments = Lazy(_stored('governments', 'governments', '00_governments.txt'))
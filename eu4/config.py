@@ -4,3 +4,18 @@ base_path = expanduser('~/Library/Application Support/Steam/steamapps/common/Eur
 common_path = join(base_path, 'common')
 history_path = join(base_path, 'history')
 map_path = join(base_path, 'map')
+
+# processes used to parse game files, None for one per core
+workers = None
+
+# whether history and national ideas store equal subtrees once (see
+# lib.nom.HashCons)
+share_subtrees = True
+
+# SQLite database written by eu4/store.py, None for eu4.sqlite in the
+# lib.memoize cache directory
+store_path = None
+
+# memory-mapped snapshot written by eu4/store.py --snapshot, None for
+# eu4.snapshot in the lib.memoize cache directory
+snapshot_path = None
@@ -5,18 +5,17 @@ import csv
 from PIL import Image
 
 from eu4.config import map_path
-from lib.nom import nom
+from eu4.store import stored
+from lib.lazy import Lazy
+from lib.nom import nom_file
 
 __all__ = [ 'positions', 'provinces', 'terrain_bmp', 'terrain_txt', 'definition' ]
 
-def _load(fn):
+def _load(fn, typed=False):
     if fn.endswith('.bmp'):
         return Image.open(join(map_path, fn), 'r')
 
-    data = None
-    with open(join(map_path, fn), 'r') as f:
-        data = f.read()
-    return nom(data)
+    return nom_file(join(map_path, fn), typed=typed)
 
 def _load_definition():
     definition = {}
@@ -27,8 +26,10 @@ def _load_definition():
             definition[(int(row[1]), int(row[2]), int(row[3]))] = int(row[0])
     return definition
 
-positions = _load('positions.txt')
-provinces = _load('provinces.bmp')
-terrain_bmp = _load('terrain.bmp')
-terrain_txt = _load('terrain.txt')
-definition = _load_definition()
+positions = Lazy(_load, 'positions.txt')
+provinces = Lazy(_load, 'provinces.bmp')
+terrain_bmp = Lazy(_load, 'terrain.bmp')
+# colors and terrain overrides are numbers
+terrain_txt = Lazy(_load, 'terrain.txt', True)
+definition = Lazy(stored(
+    'definition', [join(map_path, 'definition.csv')], _load_definition))
@@ -1,40 +1,78 @@
-from glob import iglob
+from glob import glob
 from os.path import join, split, basename
 
+from eu4 import config
 from eu4.config import history_path
-from lib.nom import nom
+from eu4.store import stored
+from lib.lazy import Lazy
 from lib.memoize import pickled
+from lib.nom import HashCons
+from lib.pool import nom_files
 
-__all__ = [ 'countries', 'provinces' ]
+__all__ = [
+    'countries',
+    'provinces',
+    'load_countries',
+    'load_provinces',
+    'country_entry',
+    'province_entry',
+]
 
-@pickled
-def _load_countries():
+def country_entry(fn, data):
+    """
+    Returns (tag, history) for the parsed country history file fn.
+    """
+    return basename(fn.split('-')[0].strip().lower()), data
+
+def province_entry(fn, data):
+    """
+    Returns (province id, history) for the parsed province history file fn.
+    """
+    if 'owner' in data.keys():
+        data['owner'] = data['owner'].lower()
+    fn = split(fn)[1]
+    province_id = int(basename(fn.split('-')[0].strip().split(' ')[0].strip()))
+    return province_id, data
+
+@pickled(inputs=[join(history_path, 'countries/*.txt')])
+def load_countries(select=None):
+    """
+    Loads country history as lib.nom.Node blocks, keeping only the key paths
+    in select if given (see lib.nom.nom).
+    """
     countries = {}
+    fns = sorted(glob(join(history_path, 'countries/*.txt')))
+    share = HashCons('countries') if config.share_subtrees else None
 
-    for fn in iglob(join(history_path, 'countries/*.txt')):
-        data = None
-        with open(fn, 'r') as f:
-            data = nom(f.read())
-            tag = basename(fn.split('-')[0].strip().lower())
-            countries[tag] = data
+    for fn, data in nom_files(fns, select, config.workers, compact=True,
+                              share=share):
+        tag, data = country_entry(fn, data)
+        countries[tag] = data
 
+    if share is not None:
+        share.finish()
     return countries
 
-@pickled
-def _load_provinces():
+@pickled(inputs=[join(history_path, 'provinces/*.txt')])
+def load_provinces(select=None):
+    """
+    Loads province history as lib.nom.Node blocks, keeping only the key paths
+    in select if given (see lib.nom.nom).
+    """
     provinces = {}
+    fns = sorted(glob(join(history_path, 'provinces/*.txt')))
+    share = HashCons('provinces') if config.share_subtrees else None
 
-    for fn in iglob(join(history_path, 'provinces/*.txt')):
-        data = None
-        with open(fn, 'r') as f:
-            data = nom(f.read())
-        if 'owner' in data.keys():
-            data['owner'] = data['owner'].lower()
-        fn = split(fn)[1]
-        province_id = int(basename(fn.split('-')[0].strip().split(' ')[0].strip()))
+    for fn, data in nom_files(fns, select, config.workers, compact=True,
+                              share=share):
+        province_id, data = province_entry(fn, data)
         provinces[province_id] = data
 
+    if share is not None:
+        share.finish()
     return provinces
 
-countries = _load_countries()
-provinces = _load_provinces()
+countries = Lazy(stored(
+    'countries', [join(history_path, 'countries/*.txt')], load_countries))
+provinces = Lazy(stored(
+    'provinces', [join(history_path, 'provinces/*.txt')], load_provinces))
@@ -1,14 +1,18 @@
 #!/usr/bin/env python
 
-from glob import iglob
+from glob import glob
 from os.path import join
 from decimal import Decimal
 from collections import OrderedDict
 
+from eu4 import config
 from eu4.common import culture_map, religion_map, governments
 from eu4.config import common_path
 from eu4.history import countries
-from lib.nom import nom
+from eu4.store import stored
+from lib.lazy import Lazy
+from lib.nom import HashCons
+from lib.pool import nom_files
 
 AND, OR, NOT = 'and', 'or', 'not'
 
@@ -17,6 +21,10 @@ __all__ = [
     'national_ideas',
     'get_idea_cost',
     'get_ideas_for_tag',
+    'idea_group_key',
+    'national_ideas_entries',
+    'resolve_all_tags',
+    'Trigger',
     'IDEA_COST_PROGRESSION',
     'IDEA_SLOTS',
 ]
@@ -53,13 +61,11 @@ IDEA_SLOTS = range(0, 9)
 
 def _load_custom_ideas():
     result = {}
+    fns = sorted(glob(join(common_path, 'custom_ideas/*.txt')))
     
-    for fn in iglob(join(common_path, 'custom_ideas/*.txt')):
-        data = None
+    # magnitudes come as Decimal or int, level costs and max levels as int
+    for fn, data in nom_files(fns, workers=config.workers, typed=True):
         category = None
-
-        with open(fn, 'r') as f:
-            data = nom(f.read())
         data = data.itervalues().next()
 
         for idea_name, values in data.iteritems():
@@ -78,10 +84,10 @@ def _load_custom_ideas():
                     }
                     continue
                 if k.startswith('level_cost_'):
-                    result[effect_name][int(k[-1])] = int(v)
+                    result[effect_name][int(k[-1])] = v
                     continue
                 if k == 'max_level':
-                    result[effect_name]['max_level'] = int(v)
+                    result[effect_name]['max_level'] = v
 
     return result
 
@@ -119,24 +125,48 @@ def _process_national_ideas(ideas):
 
     return result
     
+def idea_group_key(name):
+    """
+    Returns the national_ideas key of an idea group, e.g. swe for SWE_ideas.
+    """
+    return name[:name.find('_')].lower()
+
+def national_ideas_entries(data):
+    """
+    Returns the (key, ideas) pairs of a parsed ideas file.
+    """
+    return [(idea_group_key(k), _process_national_ideas(v))
+            for k, v in data.iteritems()]
+
+def _share_slots(share, ideas):
+    # the parsed values were shared by nom_files, only the slots are new
+    for i in IDEA_SLOTS:
+        if isinstance(ideas[i], tuple):
+            ideas[i] = share.cons(
+                tuple([share.cons(bonus) for bonus in ideas[i]]))
+
 def _load_national_ideas():
     result = OrderedDict()
+    fns = sorted(fn for fn in glob(join(common_path, 'ideas/*.txt'))
+                 if not fn.endswith('basic_ideas.txt'))
 
-    for fn in iglob(join(common_path, 'ideas/*.txt')):
-        if fn.endswith('basic_ideas.txt'):
-            continue
-        data = None
-        with open(fn, 'r') as f:
-            data = nom(f.read())
-        for k, v in data.iteritems():
-            key = k[:k.find('_')].lower()
-            ideas = _process_national_ideas(v)
+    share = HashCons('national_ideas') if config.share_subtrees else None
+
+    for fn, data in nom_files(fns, workers=config.workers, share=share):
+        for key, ideas in national_ideas_entries(data):
+            if share is not None:
+                _share_slots(share, ideas)
             result[key] = ideas
 
+    if share is not None:
+        share.finish()
     return result
 
-custom_ideas = _load_custom_ideas()
-national_ideas = _load_national_ideas()
+custom_ideas = Lazy(stored(
+    'custom_ideas', [join(common_path, 'custom_ideas/*.txt')],
+    _load_custom_ideas))
+national_ideas = Lazy(stored(
+    'national_ideas', [join(common_path, 'ideas/*.txt')], _load_national_ideas))
 missing_ideas = {
     'adm_tech_cost_modifier': { 2: 3, 'magnitude':  -0.05 },
     'caravan_power': { 2: 3, 'magnitude': 0.1 },
@@ -187,15 +217,22 @@ def get_ideas_for_tag(tag):
     try:
         return (tag, national_ideas[tag])
     except KeyError:
-        for name, ideas in national_ideas.items():
-            if 'trigger' not in ideas.keys():
-                continue
-            if is_tag_for_trigger(ideas['trigger'], tag):
-                return (name, ideas)
-        return ('default', national_ideas['default'])
+        return _trigger_index.resolve(tag)
+
+def resolve_all_tags(tags=None):
+    """
+    Returns {tag: (name, ideas)} as get_ideas_for_tag would for every tag in
+    tags, or for every country if not given.
+    """
+    if tags is None:
+        tags = countries.keys()
+    return dict((tag, get_ideas_for_tag(tag)) for tag in tags)
 
-_theocracies = [k for k, v in governments.iteritems() if 'religion' in v.keys()]
-_monarchies = [k for k, v in governments.iteritems() if 'monarchy' in v.keys()]
+def _governments_with(key):
+    return set(k for k, v in governments.iteritems() if key in v.keys())
+
+_theocracies = Lazy(_governments_with, 'religion')
+_monarchies = Lazy(_governments_with, 'monarchy')
 def is_tag_for_trigger(trigger, tag, mode=AND):
     any_match = [ False ] # closure for functions below
     all_match = [ True ]
@@ -270,7 +307,200 @@ def is_tag_for_trigger(trigger, tag, mode=AND):
         return True
 
     return False
-        
+
+def _get(mapping, key):
+    # repeated keys read as lists, which are in no mapping
+    try:
+        return mapping.get(key)
+    except TypeError:
+        return None
+
+def _member(value, collection):
+    try:
+        return value in collection
+    except TypeError:
+        return False
+
+class _Country(object):
+    """
+    The values of a country that triggers test, looked up on use so that
+    missing ones raise where is_tag_for_trigger would.
+    """
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.country = countries[tag]
+
+    def atoms(self):
+        """
+        Returns the (field, value) pairs describing the country, as used to
+        look up candidate triggers.
+        """
+        country = self.country
+        culture = country.get('primary_culture')
+        government = country.get('government')
+        result = [
+            ('tag', self.tag),
+            ('primary_culture', culture),
+            ('culture_group', _get(culture_map, culture)),
+            ('religion_group', _get(religion_map, country.get('religion'))),
+            ('government', government),
+            ('technology_group', country.get('technology_group')),
+        ]
+        if _member(government, _theocracies):
+            result.append(('government', 'theocracy'))
+        if _member(government, _monarchies):
+            result.append(('government', 'monarchy'))
+        return result
+
+_FIELDS = {
+    'tag': lambda c: c.tag,
+    'primary_culture': lambda c: c.country['primary_culture'],
+    'culture_group': lambda c: culture_map[c.country['primary_culture']],
+    'religion_group': lambda c: religion_map[c.country['religion']],
+    'technology_group': lambda c: c.country['technology_group'],
+}
+
+class _Uncompilable(Exception):
+    pass
+
+def _compile_values(value):
+    values = list(value)
+    if not all(isinstance(item, basestring) for item in values):
+        raise _Uncompilable()
+    return frozenset(item.lower() for item in values)
+
+def _compile_field(getter, values):
+    return lambda c: _member(getter(c), values)
+
+def _compile_government(values):
+    def check(c):
+        government = c.country['government']
+        found = _member(government, values)
+        if _member(government, _theocracies):
+            found |= 'theocracy' in values
+        if _member(government, _monarchies):
+            found |= 'monarchy' in values
+        return found
+    return check
+
+def _compile_not(predicates):
+    return lambda c: not any(predicate(c) for predicate in predicates)
+
+def _compile(trigger, mode):
+    """
+    Compiles a trigger as is_tag_for_trigger interprets it into a predicate
+    over _Country and the set of (field, value) atoms at least one of which a
+    country must have to match, None if that can't be told.
+    """
+    if not isinstance(trigger, dict):
+        raise _Uncompilable()
+
+    checks = []
+    atoms = []
+    for k, v in trigger.iteritems():
+        k = k.lower()
+        if not isinstance(v, list) and not isinstance(v, OrderedDict):
+            v = [ v ]
+
+        if k in _FIELDS:
+            values = _compile_values(v)
+            checks.append(_compile_field(_FIELDS[k], values))
+            atoms.append(frozenset((k, value) for value in values))
+        elif k == 'government':
+            values = _compile_values(v)
+            checks.append(_compile_government(values))
+            atoms.append(frozenset(('government', value) for value in values))
+        elif k in (OR, AND):
+            predicate, sub_atoms = _compile(v, k)
+            checks.append(predicate)
+            atoms.append(sub_atoms)
+        elif k == NOT:
+            if not isinstance(v, list):
+                v = [ v ]
+            checks.append(_compile_not([_compile(item, OR)[0] for item in v]))
+            atoms.append(None)
+
+    def predicate(c):
+        any_match = False
+        all_match = True
+        for check in checks:
+            if check(c):
+                if mode == OR:
+                    return True
+                any_match = True
+            else:
+                all_match = False
+        return any_match and all_match
+
+    if mode == OR:
+        # any check will do
+        required = None if None in atoms else frozenset().union(*atoms)
+    else:
+        # every check has to pass, so the atoms of any one of them are needed
+        known = [a for a in atoms if a is not None]
+        required = min(known, key=len) if known else None
+    return predicate, required
+
+class Trigger(object):
+    """
+    A trigger compiled once into a predicate equivalent to
+    is_tag_for_trigger(trigger, tag, mode). atoms is the set of (field, value)
+    pairs at least one of which a matching country has, or None if unknown.
+    """
+
+    def __init__(self, trigger, mode=AND):
+        try:
+            self._predicate, self.atoms = _compile(trigger, mode)
+        except _Uncompilable:
+            self._predicate = lambda c: is_tag_for_trigger(trigger, c.tag, mode)
+            self.atoms = None
+
+    def __call__(self, country):
+        return self._predicate(country)
+
+    def matches(self, tag):
+        return self._predicate(_Country(tag))
+
+class _TriggerIndex(object):
+    """
+    Maps country atoms to the idea groups whose triggers they may satisfy, so
+    that only those triggers have to be tested.
+    """
+
+    def __init__(self, national_ideas):
+        self._groups = []
+        self._index = {}
+        self._always = []
+        for name, ideas in national_ideas.iteritems():
+            if 'trigger' not in ideas.keys():
+                continue
+            trigger = Trigger(ideas['trigger'])
+            position = len(self._groups)
+            self._groups.append((name, ideas, trigger))
+            if trigger.atoms is None:
+                self._always.append(position)
+                continue
+            for atom in trigger.atoms:
+                self._index.setdefault(atom, []).append(position)
+
+    def resolve(self, tag):
+        country = _Country(tag)
+        candidates = set(self._always)
+        for atom in country.atoms():
+            try:
+                candidates.update(self._index.get(atom, ()))
+            except TypeError:
+                # unhashable values can't be in the index
+                pass
+        for position in sorted(candidates):
+            name, ideas, trigger = self._groups[position]
+            if trigger(country):
+                return (name, ideas)
+        return ('default', national_ideas['default'])
+
+_trigger_index = Lazy(_TriggerIndex, national_ideas)
+
 if __name__ == '__main__':
     print 'custom ideas:'
     for k, v in custom_ideas.iteritems():
@@ -0,0 +1,142 @@
+from os.path import join
+
+import numpy
+
+from eu4.config import map_path
+from eu4.eu_map import provinces, definition
+from lib.lazy import Lazy
+from lib.memoize import pickled
+
+__all__ = [ 'ProvinceIndex', 'province_index', 'id_raster', 'load_id_raster' ]
+
+_bitmaps = [join(map_path, fn) for fn in ('provinces.bmp', 'definition.csv')]
+
+def load_id_raster():
+    """
+    Returns a (height, width) array holding the province id of every pixel of
+    provinces.bmp.
+    """
+    rgb = numpy.asarray(provinces.convert('RGB'), dtype=numpy.uint32)
+    packed = (rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]
+    del rgb
+    colors, color_index = numpy.unique(packed, return_inverse=True)
+    ids = numpy.array([
+        definition[(int(c) >> 16, (int(c) >> 8) & 0xff, int(c) & 0xff)]
+        for c in colors], dtype=numpy.int32)
+    return ids[color_index].reshape(packed.shape)
+
+class ProvinceIndex(object):
+    """
+    Per-province pixel statistics of the province map in flat arrays, indexed
+    by the position of a province id in ids:
+
+    ids        sorted province ids
+    counts     number of pixels, i.e. the area
+    bboxes     (x0, y0, x1, y1), inclusive
+    centroids  (x, y) mean pixel position
+    runs       (y, x0, x1) horizontal runs of pixels, x1 exclusive, grouped by
+               province and ordered by row; runs[offsets[i]:offsets[i + 1]]
+               belong to ids[i]
+    """
+
+    def __init__(self, raster):
+        self.height, self.width = raster.shape
+        flat = raster.ravel()
+        size = flat.size
+
+        # a run starts at every change of id and at the start of every row
+        starts = numpy.ones(size, dtype=bool)
+        starts[1:] = flat[1:] != flat[:-1]
+        starts[::self.width] = True
+        starts = numpy.flatnonzero(starts)
+        lengths = numpy.diff(numpy.append(starts, size))
+
+        self.ids, province = numpy.unique(flat[starts], return_inverse=True)
+        order = numpy.argsort(province, kind='mergesort')
+        province = province[order]
+        starts = starts[order]
+        lengths = lengths[order]
+
+        y = starts // self.width
+        x0 = starts % self.width
+        x1 = x0 + lengths
+        self.runs = numpy.column_stack((y, x0, x1)).astype(numpy.int32)
+        self.offsets = numpy.searchsorted(
+            province, numpy.arange(len(self.ids) + 1)).astype(numpy.int64)
+
+        n = len(self.ids)
+        self.counts = numpy.bincount(province, lengths, n).astype(numpy.int64)
+        first = self.offsets[:-1]
+        self.bboxes = numpy.column_stack((
+            numpy.minimum.reduceat(x0, first),
+            numpy.minimum.reduceat(y, first),
+            numpy.maximum.reduceat(x1 - 1, first),
+            numpy.maximum.reduceat(y, first),
+        )).astype(numpy.int32)
+        # the x of every pixel of a run sums to (x0 + x1 - 1) * length / 2
+        sum_x = numpy.bincount(province, (x0 + x1 - 1) * lengths / 2.0, n)
+        sum_y = numpy.bincount(province, y * lengths, n)
+        self.centroids = numpy.column_stack(
+            (sum_x / self.counts, sum_y / self.counts))
+
+    def index_of(self, province_id):
+        i = numpy.searchsorted(self.ids, province_id)
+        if i >= len(self.ids) or self.ids[i] != province_id:
+            raise KeyError(province_id)
+        return i
+
+    def area(self, province_id):
+        return int(self.counts[self.index_of(province_id)])
+
+    def bbox(self, province_id):
+        return tuple(int(v) for v in self.bboxes[self.index_of(province_id)])
+
+    def centroid(self, province_id):
+        return tuple(float(v) for v in self.centroids[self.index_of(province_id)])
+
+    def runs_for(self, province_id):
+        i = self.index_of(province_id)
+        return self.runs[self.offsets[i]:self.offsets[i + 1]]
+
+    def pixels(self, province_id):
+        """
+        Returns the (xs, ys) arrays of every pixel of a province.
+        """
+        runs = self.runs_for(province_id)
+        lengths = runs[:, 2] - runs[:, 1]
+        ys = numpy.repeat(runs[:, 0], lengths)
+        # position within the run added to the start of the run
+        run_starts = numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        xs = numpy.repeat(runs[:, 1], lengths) + (
+            numpy.arange(lengths.sum()) - run_starts)
+        return xs, ys
+
+    def mask(self, province_id):
+        """
+        Returns a boolean array covering the bounding box of a province that is
+        set for its pixels, along with the (x0, y0) of the box.
+        """
+        x0, y0, x1, y1 = self.bbox(province_id)
+        result = numpy.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+        for y, start, end in self.runs_for(province_id):
+            result[y - y0, start - x0:end - x0] = True
+        return result, (x0, y0)
+
+    def raster(self):
+        """
+        Rebuilds the (height, width) province id array from the runs.
+        """
+        starts = self.runs[:, 0].astype(numpy.int64) * self.width + self.runs[:, 1]
+        order = numpy.argsort(starts)
+        province = numpy.repeat(
+            numpy.arange(len(self.ids)), numpy.diff(self.offsets))
+        lengths = (self.runs[:, 2] - self.runs[:, 1])[order]
+        flat = numpy.repeat(self.ids[province[order]], lengths)
+        return flat.reshape(self.height, self.width)
+
+@pickled(inputs=_bitmaps)
+def _load_province_index():
+    return ProvinceIndex(load_id_raster())
+
+province_index = Lazy(_load_province_index)
+id_raster = Lazy(ProvinceIndex.raster, province_index)
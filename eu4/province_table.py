@@ -0,0 +1,151 @@
+from array import array
+from collections import OrderedDict
+
+__all__ = [ 'ProvinceTable' ]
+
+class ProvinceTable(object):
+    """
+    Province history values in typed columns with one row per province, in
+    the order of the history dict:
+
+    ids              province ids
+    owner            index into owner_names, -1 if unowned
+    base_tax, base_production, base_manpower, extra_cost
+    trade_goods      index into trade_goods_names, -1 if unset
+    hre              1 if part of the HRE
+    terrain          index into terrain_names, -1 if unknown
+
+    Missing numbers are 0. Coded columns hold the plain value where a value is
+    taken or given, e.g. where(owner='swe').
+    """
+
+    INT_COLUMNS = ('base_tax', 'base_production', 'base_manpower', 'extra_cost')
+    CODED_COLUMNS = ('owner', 'trade_goods', 'terrain')
+
+    def __init__(self, provinces, terrain=None):
+        terrain = terrain or {}
+        self._names = dict((k, []) for k in self.CODED_COLUMNS)
+        self._codes = dict((k, {}) for k in self.CODED_COLUMNS)
+        self._rows = {}
+
+        self.ids = array('i')
+        self.hre = array('b')
+        for k in self.INT_COLUMNS:
+            setattr(self, k, array('i'))
+        for k in self.CODED_COLUMNS:
+            setattr(self, k, array('h'))
+
+        for province_id, data in provinces.iteritems():
+            self.append(province_id, data, terrain.get(province_id))
+
+    def append(self, province_id, data, terrain=None):
+        """
+        Adds a row for the history values in data and returns it.
+        """
+        if province_id in self._rows:
+            raise ValueError("province %d already has a row" % province_id)
+        row = self._rows[province_id] = len(self.ids)
+        self.ids.append(province_id)
+        self.hre.append(self._convert('hre', data.get('hre')))
+        for k in self.INT_COLUMNS:
+            getattr(self, k).append(self._convert(k, data.get(k)))
+        self.owner.append(self._convert('owner', data.get('owner')))
+        self.trade_goods.append(
+            self._convert('trade_goods', data.get('trade_goods')))
+        self.terrain.append(self._convert('terrain', terrain))
+        return row
+
+    @property
+    def owner_names(self):
+        return self._names['owner']
+
+    @property
+    def trade_goods_names(self):
+        return self._names['trade_goods']
+
+    @property
+    def terrain_names(self):
+        return self._names['terrain']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _convert(self, column, value):
+        if column == 'hre':
+            return 1 if value in ('yes', True) else 0
+        if column in self.INT_COLUMNS:
+            return 0 if value is None else int(value)
+        if value is None:
+            return -1
+        codes = self._codes[column]
+        try:
+            return codes[value]
+        except KeyError:
+            codes[value] = len(codes)
+            self._names[column].append(value)
+            return codes[value]
+
+    def code_of(self, column, value):
+        """
+        Returns the code of value in a coded column, None if no row has it.
+        """
+        if value is None:
+            return -1
+        return self._codes[column].get(value)
+
+    def row_of(self, province_id):
+        return self._rows[province_id]
+
+    def value(self, row, column):
+        """
+        Returns the value of a column for a row, None for unset coded values.
+        """
+        v = getattr(self, column)[row]
+        if column == 'hre':
+            return bool(v)
+        if column in self.CODED_COLUMNS:
+            return None if v < 0 else self._names[column][v]
+        return v
+
+    def set_value(self, row, column, value):
+        """
+        Sets a column of a row from a history value such as '5' or 'yes'; None
+        resets it.
+        """
+        if column not in self.INT_COLUMNS + self.CODED_COLUMNS + ('hre',):
+            raise KeyError(column)
+        getattr(self, column)[row] = self._convert(column, value)
+
+    def where(self, **conditions):
+        """
+        Returns the rows whose columns equal all of the given values.
+        """
+        rows = xrange(len(self.ids))
+        for column, value in conditions.iteritems():
+            if column == 'hre':
+                value = bool(value)
+            elif column in self.CODED_COLUMNS:
+                value = self.code_of(column, value)
+                if value is None:
+                    return []
+            values = getattr(self, column)
+            rows = [r for r in rows if values[r] == value]
+        return list(rows)
+
+    def group_by(self, column, rows=None):
+        """
+        Returns an OrderedDict of value: rows for the given rows, or all rows,
+        with values in order of first appearance.
+        """
+        values = getattr(self, column)
+        groups = OrderedDict()
+        for r in (xrange(len(self.ids)) if rows is None else rows):
+            try:
+                groups[values[r]].append(r)
+            except KeyError:
+                groups[values[r]] = [r]
+        if column not in self.CODED_COLUMNS:
+            return groups
+        names = self._names[column]
+        return OrderedDict(
+            (names[k] if k >= 0 else None, v) for k, v in groups.iteritems())
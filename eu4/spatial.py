@@ -0,0 +1,165 @@
+import numpy
+
+from eu4.eu_map import positions
+from eu4.pixels import province_index, id_raster
+from lib.lazy import Lazy
+
+__all__ = [ 'SpatialIndex', 'centroid_index', 'position_index' ]
+
+# queries for nearest provinces are answered in chunks of this many points
+_BATCH = 1024
+
+class SpatialIndex(object):
+    """
+    Answers which province is at a pixel from the province id raster and
+    point, box, radius and nearest-neighbour queries over one point per
+    province from a grid of cell x cell buckets. Coordinates are pixels of
+    provinces.bmp, x to the right and y down.
+    """
+
+    def __init__(self, raster, ids, points, cell=32):
+        self.raster = raster
+        self.height, self.width = raster.shape
+        self.cell = cell
+        self.ids = numpy.asarray(ids)
+        self.points = numpy.asarray(points, dtype=numpy.float64)
+
+        self.grid_width = self.width // cell + 1
+        self.grid_height = self.height // cell + 1
+        cells = self._cells(self.points[:, 0], self.points[:, 1])
+        self._order = numpy.argsort(cells, kind='mergesort')
+        self._cell_offsets = numpy.searchsorted(
+            cells[self._order], numpy.arange(self.grid_width * self.grid_height + 1))
+
+    def _cells(self, xs, ys):
+        cx = numpy.clip((xs // self.cell).astype(numpy.int64), 0, self.grid_width - 1)
+        cy = numpy.clip((ys // self.cell).astype(numpy.int64), 0, self.grid_height - 1)
+        return cy * self.grid_width + cx
+
+    def _candidates(self, x0, y0, x1, y1):
+        """
+        Returns the indices of points in every cell overlapping the box.
+        """
+        cx0 = max(int(x0 // self.cell), 0)
+        cy0 = max(int(y0 // self.cell), 0)
+        cx1 = min(int(x1 // self.cell), self.grid_width - 1)
+        cy1 = min(int(y1 // self.cell), self.grid_height - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return numpy.zeros(0, dtype=numpy.int64)
+        offsets = self._cell_offsets
+        slices = [
+            self._order[offsets[row + cx0]:offsets[row + cx1 + 1]]
+            for row in xrange(cy0 * self.grid_width, (cy1 + 1) * self.grid_width,
+                              self.grid_width)]
+        return numpy.concatenate(slices)
+
+    def province_at(self, x, y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError((x, y))
+        return int(self.raster[int(y), int(x)])
+
+    def provinces_at(self, xs, ys):
+        """
+        Batch form of province_at, with -1 for coordinates off the map.
+        """
+        xs = numpy.asarray(xs).astype(numpy.int64)
+        ys = numpy.asarray(ys).astype(numpy.int64)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        result = numpy.full(xs.shape, -1, dtype=numpy.int64)
+        result[inside] = self.raster[ys[inside], xs[inside]]
+        return result
+
+    def in_box(self, x0, y0, x1, y1):
+        """
+        Returns the ids of provinces whose point lies in the box, inclusive.
+        """
+        found = self._candidates(x0, y0, x1, y1)
+        points = self.points[found]
+        inside = ((points[:, 0] >= x0) & (points[:, 0] <= x1) &
+                  (points[:, 1] >= y0) & (points[:, 1] <= y1))
+        return numpy.sort(self.ids[found[inside]])
+
+    def in_radius(self, x, y, radius):
+        """
+        Returns the ids of provinces whose point lies within radius of (x, y),
+        nearest first.
+        """
+        found = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        distances = numpy.hypot(self.points[found, 0] - x, self.points[found, 1] - y)
+        inside = distances <= radius
+        found, distances = found[inside], distances[inside]
+        return self.ids[found[numpy.argsort(distances, kind='mergesort')]]
+
+    def near_province(self, province_id, radius):
+        """
+        Returns the ids of other provinces within radius of province_id's
+        point, nearest first.
+        """
+        i = numpy.flatnonzero(self.ids == province_id)
+        if not len(i):
+            raise KeyError(province_id)
+        x, y = self.points[i[0]]
+        found = self.in_radius(x, y, radius)
+        return found[found != province_id]
+
+    def nearest(self, x, y):
+        """
+        Returns the id of the province whose point is nearest to (x, y),
+        searching rings of cells outwards until no closer point is possible.
+        Points off the map are compared against every province instead.
+        """
+        if not len(self.ids):
+            return None
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            distances = numpy.hypot(self.points[:, 0] - x, self.points[:, 1] - y)
+            return int(self.ids[numpy.argmin(distances)])
+        best, best_distance = None, numpy.inf
+        cx, cy = int(x // self.cell), int(y // self.cell)
+        ring = 0
+        limit = max(self.grid_width, self.grid_height)
+        while ring <= limit:
+            # nothing in this ring or beyond can be closer than this
+            if (ring - 1) * self.cell > best_distance:
+                break
+            x0, y0 = (cx - ring) * self.cell, (cy - ring) * self.cell
+            x1 = (cx + ring + 1) * self.cell - 1
+            y1 = (cy + ring + 1) * self.cell - 1
+            found = self._candidates(x0, y0, x1, y1)
+            if len(found):
+                distances = numpy.hypot(
+                    self.points[found, 0] - x, self.points[found, 1] - y)
+                i = numpy.argmin(distances)
+                if distances[i] < best_distance:
+                    best, best_distance = found[i], distances[i]
+            ring += 1
+        return None if best is None else int(self.ids[best])
+
+    def nearest_batch(self, xs, ys):
+        """
+        Batch form of nearest for arrays of coordinates.
+        """
+        xs = numpy.asarray(xs, dtype=numpy.float64).ravel()
+        ys = numpy.asarray(ys, dtype=numpy.float64).ravel()
+        result = numpy.empty(len(xs), dtype=self.ids.dtype)
+        for start in xrange(0, len(xs), _BATCH):
+            qx = xs[start:start + _BATCH, None]
+            qy = ys[start:start + _BATCH, None]
+            squared = (self.points[:, 0] - qx) ** 2 + (self.points[:, 1] - qy) ** 2
+            result[start:start + _BATCH] = self.ids[numpy.argmin(squared, axis=1)]
+        return result
+
+def _load_centroid_index(raster, index):
+    return SpatialIndex(raster, index.ids, index.centroids)
+
+def _load_position_index(raster, positions):
+    ids = sorted(int(k) for k in positions.keys())
+    height = raster.shape[0]
+    # the first pair of each position is the city; y counts up from the bottom
+    points = [
+        (float(positions[str(k)]['position'][0]),
+         height - float(positions[str(k)]['position'][1]))
+        for k in ids]
+    return SpatialIndex(raster, ids, points)
+
+centroid_index = Lazy(_load_centroid_index, id_raster, province_index)
+position_index = Lazy(_load_position_index, id_raster, positions)
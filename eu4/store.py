@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+from functools import wraps
+from os.path import exists, join
+import cPickle
+import errno
+import os
+import sqlite3
+
+from eu4 import config
+from lib import memoize
+from lib.lazy import resolve
+from lib.memoize import input_stats
+from lib.snapshot import Snapshot, write_snapshot
+
+__all__ = [
+    'Store',
+    'open_store',
+    'open_snapshot',
+    'stored',
+    'import_datasets',
+    'registered',
+    'snapshot_datasets',
+]
+
+# name: (inputs, loader, args) for every dataset passed to stored()
+_datasets = OrderedDict()
+
+# snapshots opened so far by path; the mapping stays valid when the file is
+# replaced, it only goes stale
+_snapshots = {}
+
+# modules registering datasets, imported before importing everything
+_MODULES = ('eu4.history', 'eu4.common', 'eu4.ideas', 'eu4.eu_map', 'eu4.terrain')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    name TEXT PRIMARY KEY, type TEXT NOT NULL, inputs BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (
+    dataset TEXT NOT NULL, key TEXT NOT NULL, position INTEGER NOT NULL,
+    data BLOB NOT NULL, PRIMARY KEY (dataset, key));
+CREATE INDEX IF NOT EXISTS entries_position ON entries (dataset, position);
+
+CREATE TABLE IF NOT EXISTS provinces (
+    id INTEGER PRIMARY KEY, owner TEXT, controller TEXT, culture TEXT,
+    religion TEXT, base_tax INTEGER, base_production INTEGER,
+    base_manpower INTEGER, trade_goods TEXT, hre INTEGER, extra_cost INTEGER);
+CREATE INDEX IF NOT EXISTS provinces_owner ON provinces (owner);
+CREATE INDEX IF NOT EXISTS provinces_trade_goods ON provinces (trade_goods);
+CREATE TABLE IF NOT EXISTS countries (
+    tag TEXT PRIMARY KEY, capital INTEGER, government TEXT, religion TEXT,
+    primary_culture TEXT, technology_group TEXT);
+CREATE INDEX IF NOT EXISTS countries_capital ON countries (capital);
+CREATE TABLE IF NOT EXISTS terrain (
+    id INTEGER PRIMARY KEY, terrain TEXT);
+CREATE INDEX IF NOT EXISTS terrain_terrain ON terrain (terrain);
+CREATE TABLE IF NOT EXISTS definition (
+    id INTEGER PRIMARY KEY, red INTEGER, green INTEGER, blue INTEGER);
+CREATE INDEX IF NOT EXISTS definition_color ON definition (red, green, blue);
+"""
+
+# history columns of the provinces and countries tables, which hold the
+# undated values of the datasets of the same name
+_COLUMNS = {
+    'provinces': (
+        ('owner', str), ('controller', str), ('culture', str),
+        ('religion', str), ('base_tax', int), ('base_production', int),
+        ('base_manpower', int), ('trade_goods', str), ('hre', bool),
+        ('extra_cost', int),
+    ),
+    'countries': (
+        ('capital', int), ('government', str), ('religion', str),
+        ('primary_culture', str), ('technology_group', str),
+    ),
+}
+_KEYS = { 'provinces': 'id', 'countries': 'tag' }
+
+def _path(path=None):
+    return path or config.store_path or join(memoize.cache_dir, 'eu4.sqlite')
+
+def _snapshot_path(path=None):
+    return (path or config.snapshot_path or
+            join(memoize.cache_dir, 'eu4.snapshot'))
+
+def _makedirs(path):
+    # the directory of path, which may already exist
+    directory = os.path.dirname(path)
+    if not directory:
+        return
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def _column(value, kind):
+    # repeated keys keep the last value, blocks are not columns
+    if isinstance(value, list):
+        value = value[-1] if value else None
+    if not isinstance(value, basestring):
+        return None
+    if kind is bool:
+        return 1 if value == 'yes' else 0
+    if kind is int:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return value
+
+def _history_value(value, kind):
+    if kind is bool:
+        return 'yes' if value else 'no'
+    return str(value)
+
+class Store(object):
+    """
+    Parsed game data in SQLite: every dataset as pickled entries indexed by
+    key, plus the provinces, countries, terrain and definition tables for
+    queries.
+    """
+
+    def __init__(self, path=None):
+        self.path = _path(path)
+        _makedirs(self.path)
+        self.db = sqlite3.connect(self.path)
+        self.db.text_factory = str
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def fresh(self, name):
+        """
+        Returns whether the store holds dataset name for the current inputs.
+        """
+        row = self.db.execute(
+            'SELECT inputs FROM datasets WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return False
+        return cPickle.loads(str(row[0])) == input_stats(_datasets[name][0])
+
+    def load(self, name):
+        """
+        Returns a dataset as the dict or OrderedDict it was loaded as.
+        """
+        row = self.db.execute(
+            'SELECT type FROM datasets WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        result = OrderedDict() if row[0] == 'OrderedDict' else {}
+        for data, in self.db.execute(
+                'SELECT data FROM entries WHERE dataset = ? ORDER BY position',
+                (name,)):
+            k, v = cPickle.loads(str(data))
+            result[k] = v
+        return result
+
+    def get(self, name, key):
+        row = self.db.execute(
+            'SELECT data FROM entries WHERE dataset = ? AND key = ?',
+            (name, repr(key))).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return cPickle.loads(str(row[0]))[1]
+
+    def query(self, sql, *args):
+        return self.db.execute(sql, args).fetchall()
+
+    def history(self, table, fields):
+        """
+        Returns {id or tag: OrderedDict} of the undated values of fields from
+        the provinces or countries table, as strings the way the history files
+        have them. Unset values are left out.
+        """
+        kinds = dict(_COLUMNS[table])
+        for f in fields:
+            if f not in kinds:
+                raise KeyError(f)
+        rows = self.db.execute('SELECT %s, %s FROM %s' % (
+            _KEYS[table], ', '.join(fields), table))
+        result = {}
+        for row in rows:
+            result[row[0]] = OrderedDict(
+                (f, _history_value(v, kinds[f]))
+                for f, v in zip(fields, row[1:]) if v is not None)
+        return result
+
+    def write(self, name, data):
+        inputs, loader, args = _datasets[name]
+        with self.db:
+            self.db.execute('DELETE FROM entries WHERE dataset = ?', (name,))
+            self.db.executemany(
+                'INSERT INTO entries VALUES (?, ?, ?, ?)',
+                ((name, repr(k), i, sqlite3.Binary(
+                    cPickle.dumps((k, v), cPickle.HIGHEST_PROTOCOL)))
+                 for i, (k, v) in enumerate(data.iteritems())))
+            self._write_table(name, data)
+            self.db.execute(
+                'INSERT OR REPLACE INTO datasets VALUES (?, ?, ?)',
+                (name, type(data).__name__, sqlite3.Binary(cPickle.dumps(
+                    input_stats(inputs), cPickle.HIGHEST_PROTOCOL))))
+
+    def _write_table(self, name, data):
+        if name in _COLUMNS:
+            columns = _COLUMNS[name]
+            self.db.execute('DELETE FROM %s' % name)
+            self.db.executemany(
+                'INSERT INTO %s VALUES (%s)' % (
+                    name, ', '.join('?' * (len(columns) + 1))),
+                ([k] + [_column(v.get(c), kind) for c, kind in columns]
+                 for k, v in data.iteritems()))
+        elif name == 'terrain':
+            self.db.execute('DELETE FROM terrain')
+            self.db.executemany(
+                'INSERT INTO terrain VALUES (?, ?)', data.iteritems())
+        elif name == 'definition':
+            self.db.execute('DELETE FROM definition')
+            self.db.executemany(
+                'INSERT INTO definition VALUES (?, ?, ?, ?)',
+                ((v,) + k for k, v in data.iteritems()))
+
+def open_store(path=None):
+    """
+    Returns the Store at path, or the configured one, None if it does not
+    exist yet.
+    """
+    path = _path(path)
+    if not exists(path):
+        return None
+    return Store(path)
+
+def open_snapshot(path=None):
+    """
+    Returns the Snapshot at path, or the configured one, None if it does not
+    exist yet. A snapshot is only opened once per process.
+    """
+    path = _snapshot_path(path)
+    try:
+        return _snapshots[path]
+    except KeyError:
+        pass
+    if not exists(path):
+        return None
+    snapshot = _snapshots[path] = Snapshot(path)
+    return snapshot
+
+def _from_snapshot(name):
+    snapshot = open_snapshot()
+    if snapshot is None or name not in snapshot.root:
+        return None
+    # (input stats, dataset), leaving the dataset mapped
+    entry = snapshot.root.lazy(name)
+    if entry[0] != input_stats(_datasets[name][0]):
+        return None
+    return entry.lazy(1)
+
+def stored(name, inputs, loader, *args):
+    """
+    Registers dataset name as loader(*args), which reads the files matched by
+    the glob patterns in inputs, and returns a function reading it from the
+    snapshot or the store when either holds it for the current inputs, or
+    calling loader otherwise. Lazy arguments are resolved only when loader is
+    called.
+    """
+    _datasets[name] = (inputs, loader, args)
+
+    @wraps(loader)
+    def load():
+        mapped = _from_snapshot(name)
+        if mapped is not None:
+            return mapped
+        store = open_store()
+        if store is not None:
+            try:
+                if store.fresh(name):
+                    return store.load(name)
+            finally:
+                store.close()
+        return loader(*[resolve(arg) for arg in args])
+
+    load.__name__ = name
+    return load
+
+def registered():
+    """
+    Returns an OrderedDict of name: input glob patterns of every dataset
+    registered with stored() by the modules that have been imported.
+    """
+    return OrderedDict(
+        (name, inputs) for name, (inputs, loader, args) in _datasets.iteritems())
+
+def import_datasets(path=None, names=None):
+    """
+    Loads every registered dataset, or those in names, and writes them to the
+    store at path, or the configured one.
+    """
+    for module in _MODULES:
+        __import__(module)
+    store = Store(path)
+    try:
+        for name in (names or _datasets.keys()):
+            inputs, loader, args = _datasets[name]
+            store.write(name, loader(*[resolve(arg) for arg in args]))
+    finally:
+        store.close()
+
+def snapshot_datasets(path=None, names=None):
+    """
+    Loads every registered dataset, or those in names, and writes them to the
+    snapshot at path, or the configured one.
+    """
+    for module in _MODULES:
+        __import__(module)
+    path = _snapshot_path(path)
+    _makedirs(path)
+    root = {}
+    for name in (names or _datasets.keys()):
+        inputs, loader, args = _datasets[name]
+        root[name] = (
+            input_stats(inputs), loader(*[resolve(arg) for arg in args]))
+    write_snapshot(path, root)
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(
+        description="Imports the parsed game data into an SQLite database.")
+    p.add_argument('--path', help="database or snapshot file")
+    p.add_argument('--snapshot', '-s', action='store_true',
+                   help="write a memory-mapped snapshot instead of a database")
+    p.add_argument('--query', '-q', help="print the rows of an SQL query "
+                                         "instead of importing")
+    p.add_argument('datasets', nargs='*', help="datasets to import, default all")
+    options = p.parse_args()
+
+    if options.query:
+        store = Store(options.path)
+        for row in store.query(options.query):
+            print '\t'.join(str(v) for v in row)
+        store.close()
+        return
+
+    if options.snapshot:
+        snapshot_datasets(options.path, options.datasets)
+    else:
+        import_datasets(options.path, options.datasets)
+
+if __name__ == '__main__':
+    # datasets register with eu4.store, not with this copy of it
+    from eu4.store import main
+    main()
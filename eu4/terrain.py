@@ -1,20 +1,35 @@
+from os.path import join
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from eu4.config import map_path
 from eu4.eu_map import provinces, terrain_bmp, terrain_txt, definition
+from eu4.store import stored
+from lib.lazy import Lazy
 from lib.memoize import pickled
 
 __all__ = ['color_map', 'terrain_overrides', 'province_terrain']
 
-@pickled
+_terrain_txt = [join(map_path, 'terrain.txt')]
+_bitmaps = [join(map_path, fn) for fn in ('provinces.bmp', 'terrain.bmp', 'definition.csv')]
+
+@pickled(inputs=_terrain_txt)
 def _load_map():
     color_map = {}
     terrain = terrain_txt['terrain']
 
     for mapping in terrain.values():
-        color_map[int(mapping['color'][0])] = mapping['type']
+        color_map[mapping['color'][0]] = mapping['type']
 
     return color_map
 
-@pickled
-def _load_terrain(color_map, terrain_overrides):
+# terrain.bmp indices that never count towards a province's terrain
+IGNORED_TERRAIN = (5, 8, 10, 11, 12, 13, 14, 15, 17, 18)
+
+def _count_terrain(color_map, terrain_overrides):
     result = {}
     
     # find all colors per province
@@ -26,7 +41,7 @@ def _load_terrain(color_map, terrain_overrides):
                 continue
 
             terrain = terrain_bmp.getpixel( (x, y) )
-            if terrain in (5, 8, 10, 11, 12, 13, 14, 15, 17, 18):
+            if terrain in IGNORED_TERRAIN:
                 continue
 
             terrain = color_map[terrain]
@@ -42,6 +57,66 @@ def _load_terrain(color_map, terrain_overrides):
             except KeyError:
                 province_map[terrain] = 1
 
+    return result
+
+def _count_terrain_numpy(color_map, terrain_overrides):
+    """
+    Same as _count_terrain, including the order terrain types are first seen
+    in, so that ties for the most common terrain break the same way.
+    """
+    width, height = terrain_bmp.size
+    # pixels in the order _count_terrain visits them: by column, then row
+    rgb = numpy.asarray(provinces.convert('RGB'), dtype=numpy.uint32)
+    packed = ((rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2])
+    packed = packed[:height, :width].T.ravel()
+    terrain = numpy.asarray(terrain_bmp.copy())[:height, :width].T.ravel()
+    del rgb
+
+    # province colors to ids through the handful of distinct colors
+    colors, color_index = numpy.unique(packed, return_inverse=True)
+    del packed
+    ids = numpy.array([
+        definition[(int(c) >> 16, (int(c) >> 8) & 0xff, int(c) & 0xff)]
+        for c in colors])
+    keep = ~numpy.in1d(ids, list(terrain_overrides))[color_index]
+    keep &= ~numpy.in1d(terrain, IGNORED_TERRAIN)
+
+    # terrain indices to type codes
+    types = sorted(set(color_map.itervalues()))
+    type_lut = numpy.full(256, -1, dtype=numpy.int64)
+    for index, name in color_map.iteritems():
+        if 0 <= index < 256:
+            type_lut[index] = types.index(name)
+    codes = type_lut[terrain]
+    missing = keep & (codes < 0)
+    if missing.any():
+        raise KeyError(int(terrain[numpy.flatnonzero(missing)[0]]))
+
+    pairs = color_index[keep].astype(numpy.int64) * len(types) + codes[keep]
+    del keep, codes, terrain, color_index
+    unique_pairs, first, counts = numpy.unique(
+        pairs, return_index=True, return_counts=True)
+    by_first = numpy.argsort(first)
+
+    result = {}
+    for pair, count in zip(unique_pairs[by_first], counts[by_first]):
+        province_key = int(ids[pair // len(types)])
+        try:
+            province_map = result[province_key]
+        except KeyError:
+            result[province_key] = {}
+            province_map = result[province_key]
+        province_map[types[pair % len(types)]] = int(count)
+
+    return result
+
+@pickled(inputs=_bitmaps)
+def _load_terrain(color_map, terrain_overrides):
+    if numpy is None:
+        result = _count_terrain(color_map, terrain_overrides)
+    else:
+        result = _count_terrain_numpy(color_map, terrain_overrides)
+
     # find the most common color per province
     for province_key in result.keys():
         inverted = dict((v, k) for k, v in result[province_key].iteritems())
@@ -49,7 +124,7 @@ def _load_terrain(color_map, terrain_overrides):
 
     return result
 
-@pickled
+@pickled(inputs=_terrain_txt)
 def _load_terrain_overrides():
     result = {}
 
@@ -61,7 +136,7 @@ def _load_terrain_overrides():
         if 'terrain_override' not in v.keys():
             continue
         for province_id in v['terrain_override']:
-            result[int(province_id)] = k
+            result[province_id] = k
 
     # zurich (1869) is hills for some reason
     result[1869] = 'hills'
@@ -69,6 +144,9 @@ def _load_terrain_overrides():
     return result
 
 
-color_map = _load_map()
-terrain_overrides = _load_terrain_overrides()
-province_terrain = _load_terrain(color_map, terrain_overrides)
+color_map = Lazy(_load_map)
+terrain_overrides = Lazy(stored(
+    'terrain_overrides', _terrain_txt, _load_terrain_overrides))
+province_terrain = Lazy(stored(
+    'terrain', _bitmaps + _terrain_txt, _load_terrain,
+    color_map, terrain_overrides))
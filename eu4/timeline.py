@@ -0,0 +1,184 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from heapq import merge
+from os.path import join
+
+from eu4.config import history_path
+from eu4.history import load_countries, load_provinces
+from lib.lazy import Lazy
+from lib.memoize import pickled
+from lib.nom import Node
+
+__all__ = [
+    'Timeline',
+    'parse_date',
+    'sweep',
+    'load_country_timelines',
+    'load_province_timelines',
+    'country_timelines',
+    'province_timelines',
+    'country_state',
+    'province_state',
+]
+
+def parse_date(s):
+    """
+    Returns a date such as '1444.11.11' as a (year, month, day) tuple, None if
+    s is not a date.
+    """
+    parts = s.split('.')
+    if len(parts) != 3:
+        return None
+    try:
+        return tuple(int(part) for part in parts)
+    except ValueError:
+        return None
+
+def _as_date(date):
+    if isinstance(date, tuple):
+        return date
+    parsed = parse_date(date)
+    if parsed is None:
+        raise ValueError("not a date: %r" % (date,))
+    return parsed
+
+def _last(key, value):
+    # a key repeated in one block is a list; the game keeps the last value
+    if isinstance(value, list) and not key.startswith(('add_', 'remove_')):
+        return value[-1]
+    return value
+
+class Timeline(object):
+    """
+    The history of one province or country: the undated values in base, the
+    sorted dates of dated blocks with the (field, value) changes made at each,
+    and per field the sorted dates and values it was set to, which state()
+    searches.
+    """
+
+    def __init__(self, history, fields=None, lower=()):
+        self.base = OrderedDict()
+        changes = []
+        for k, v in history.iteritems():
+            date = parse_date(k)
+            if date is None:
+                if fields is None or k in fields:
+                    self.base[k] = self._normalize(k, v, lower)
+                continue
+            for block in (v if isinstance(v, list) else [v]):
+                if not isinstance(block, (dict, Node)):
+                    continue
+                for field, value in block.iteritems():
+                    if fields is None or field in fields:
+                        value = self._normalize(field, value, lower)
+                        changes.append((date, len(changes), field, value))
+        # dated blocks apply in date order, ties in file order
+        changes.sort(key=lambda change: change[:2])
+
+        self.dates = []
+        self.changes = []
+        self._fields = {}
+        for date, _, field, value in changes:
+            if not self.dates or self.dates[-1] != date:
+                self.dates.append(date)
+                self.changes.append([])
+            self.changes[-1].append((field, value))
+            dates, values = self._fields.setdefault(field, ([], []))
+            dates.append(date)
+            values.append(value)
+
+    @staticmethod
+    def _normalize(field, value, lower):
+        value = _last(field, value)
+        if field in lower and isinstance(value, basestring):
+            value = value.lower()
+        return value
+
+    def value(self, field, date=None):
+        """
+        Returns the value of field in effect on date, including changes made
+        on it, or the undated value if date is None. Raises KeyError if it is
+        not set by then.
+        """
+        if date is not None and field in self._fields:
+            dates, values = self._fields[field]
+            i = bisect_right(dates, _as_date(date))
+            if i:
+                return values[i - 1]
+        return self.base[field]
+
+    def state(self, date=None):
+        """
+        Returns an OrderedDict of every value in effect on date, including
+        changes made on it, or the undated values if date is None.
+        """
+        result = OrderedDict(self.base)
+        if date is None:
+            return result
+        date = _as_date(date)
+        for field, (dates, values) in self._fields.iteritems():
+            i = bisect_right(dates, date)
+            if i:
+                result[field] = values[i - 1]
+        return result
+
+def _timeline_changes(group, key, timeline):
+    n = 0
+    for date, changes in zip(timeline.dates, timeline.changes):
+        for field, value in changes:
+            # n keeps the values themselves from ever being compared
+            yield (date, group, key, n, field, value)
+            n += 1
+
+def sweep(dates, *groups):
+    """
+    Walks every change of groups of timelines such as ('province',
+    province_timelines) once in date order, yielding (date, changes) for each
+    of dates in date order as soon as it is reached. changes lists the
+    (kind, key, field, value) changes made after the previous date, up to and
+    including date.
+    """
+    changes = merge(*[
+        _timeline_changes(group, key, timeline)
+        for group, (kind, timelines) in enumerate(groups)
+        for key, timeline in timelines.iteritems()])
+    pending = next(changes, None)
+    for date in sorted(set(_as_date(date) for date in dates)):
+        made = []
+        while pending is not None and pending[0] <= date:
+            _, group, key, _, field, value = pending
+            made.append((groups[group][0], key, field, value))
+            pending = next(changes, None)
+        yield date, made
+
+def _select(fields):
+    if fields is None:
+        return None
+    return list(fields) + ['*/' + field for field in fields]
+
+@pickled(inputs=[join(history_path, 'provinces/*.txt')])
+def load_province_timelines(fields=None):
+    """
+    Returns {province id: Timeline}, keeping only the given fields if any.
+    """
+    return dict(
+        (province_id, Timeline(history, fields, lower=('owner',)))
+        for province_id, history in load_provinces(_select(fields)).iteritems())
+
+@pickled(inputs=[join(history_path, 'countries/*.txt')])
+def load_country_timelines(fields=None):
+    """
+    Returns {tag: Timeline}, keeping only the given fields if any.
+    """
+    return dict(
+        (tag, Timeline(history, fields))
+        for tag, history in load_countries(_select(fields)).iteritems())
+
+province_timelines = Lazy(load_province_timelines)
+country_timelines = Lazy(load_country_timelines)
+
+def province_state(province_id, date):
+    return province_timelines[province_id].state(date)
+
+def country_state(tag, date):
+    return country_timelines[tag].state(date)
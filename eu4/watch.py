@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+from glob import glob
+from hashlib import sha1
+from os.path import basename, join
+import os
+import time
+
+from eu4 import common, eu_map, history, ideas, terrain
+from eu4.config import map_path
+from eu4.store import registered
+from lib.lazy import invalidate, loaded, resolve
+from lib.nom import nom_file, iter_nom, KEY, START, END
+
+__all__ = [ 'Watcher' ]
+
+# where the lazy value of every dataset lives
+_LAZIES = {
+    'provinces': (history, 'provinces'),
+    'countries': (history, 'countries'),
+    'national_ideas': (ideas, 'national_ideas'),
+    'custom_ideas': (ideas, 'custom_ideas'),
+    'cultures': (common, 'cultures'),
+    'religions': (common, 'religions'),
+    'governments': (common, 'governments'),
+    'definition': (eu_map, 'definition'),
+    'terrain': (terrain, 'province_terrain'),
+    'terrain_overrides': (terrain, 'terrain_overrides'),
+}
+
+# lazy values derived from a dataset, loaded again after it changes
+_DEPENDENTS = {
+    'national_ideas': [(ideas, '_trigger_index')],
+    'cultures': [(common, 'culture_map')],
+    'religions': [(common, 'religion_map')],
+    'governments': [(ideas, '_theocracies'), (ideas, '_monarchies')],
+    'terrain_overrides': [(terrain, 'province_terrain')],
+}
+
+# lazy values read straight from a game file rather than through a dataset,
+# and those derived from them, loaded again after the file changes
+_FILE_LAZIES = {
+    join(map_path, 'terrain.txt'): [
+        (eu_map, 'terrain_txt'), (terrain, 'color_map'),
+        (terrain, 'province_terrain')],
+    join(map_path, 'provinces.bmp'): [(eu_map, 'provinces')],
+    join(map_path, 'terrain.bmp'): [(eu_map, 'terrain_bmp')],
+}
+
+def _hash(fn):
+    with open(fn, 'rb') as f:
+        return sha1(f.read()).hexdigest()
+
+def _top_level_keys(fn):
+    keys = []
+    depth = 0
+    with open(fn, 'r') as f:
+        for kind, data in iter_nom(f):
+            if kind == START:
+                depth += 1
+            elif kind == END:
+                depth -= 1
+            elif kind == KEY and depth == 0:
+                keys.append(data)
+    return keys
+
+class Watcher(object):
+    """
+    Polls the size and mtime of every file the registered datasets read,
+    confirming changes by content hash. Changed province, country and
+    national idea files are parsed on their own and patched into the loaded
+    datasets; any other change makes its whole dataset load again on next
+    use. Lazy values derived from a changed dataset are dropped as well.
+    """
+
+    def __init__(self):
+        self._inputs = registered()
+        # filename: [size, mtime, sha1 or None until first needed, datasets]
+        self._files = {}
+        for fn, datasets, st in self._scan():
+            self._files[fn] = [st.st_size, st.st_mtime, None, datasets]
+        # ideas filename: national_ideas keys it defines
+        self._idea_keys = {}
+        for fn in self._files:
+            if self._is_national_ideas(fn):
+                self._idea_keys[fn] = [
+                    ideas.idea_group_key(k) for k in _top_level_keys(fn)]
+
+    def _matches(self, inputs):
+        if callable(inputs):
+            inputs = inputs()
+        return set(fn for pattern in inputs for fn in glob(pattern))
+
+    def _scan(self):
+        files = {}
+        for name, inputs in self._inputs.iteritems():
+            for fn in self._matches(inputs):
+                files.setdefault(fn, []).append(name)
+        for fn, datasets in files.iteritems():
+            try:
+                yield fn, datasets, os.stat(fn)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _is_national_ideas(fn):
+        return ('/ideas/' in fn.replace(os.sep, '/') and
+                not fn.endswith('basic_ideas.txt'))
+
+    def _changed_files(self):
+        """
+        Returns {filename: datasets} of every file added, removed or changed
+        since the last poll.
+        """
+        changed = {}
+        seen = set()
+        for fn, datasets, st in self._scan():
+            seen.add(fn)
+            known = self._files.get(fn)
+            if known is None:
+                self._files[fn] = [st.st_size, st.st_mtime, _hash(fn), datasets]
+                changed[fn] = datasets
+                continue
+            if known[:2] == [st.st_size, st.st_mtime]:
+                continue
+            digest = _hash(fn)
+            if known[2] != digest:
+                changed[fn] = datasets
+            self._files[fn] = [st.st_size, st.st_mtime, digest, datasets]
+        for fn in set(self._files) - seen:
+            changed[fn] = self._files.pop(fn)[3]
+        return changed
+
+    def _entries(self, name, fn):
+        """
+        Returns the (key, value) pairs a file now defines and the keys it no
+        longer defines, value None for removed keys.
+        """
+        exists = os.path.exists(fn)
+        if name == 'provinces':
+            if exists:
+                return [history.province_entry(fn, nom_file(fn))]
+            return [(history.province_entry(basename(fn), {})[0], None)]
+        if name == 'countries':
+            if exists:
+                return [history.country_entry(fn, nom_file(fn))]
+            return [(history.country_entry(fn, {})[0], None)]
+        entries = ideas.national_ideas_entries(nom_file(fn)) if exists else []
+        keys = [k for k, v in entries]
+        removed = [(k, None) for k in self._idea_keys.get(fn, ()) if k not in keys]
+        self._idea_keys[fn] = keys
+        return removed + entries
+
+    def poll(self):
+        """
+        Checks every file once and updates the loaded datasets. Returns
+        (dataset, key, value) for every entry that changed, value None if it
+        was removed, or (dataset, None, None) where the whole dataset loads
+        again on next use.
+        """
+        by_dataset = {}
+        for fn, datasets in sorted(self._changed_files().iteritems()):
+            for name in datasets:
+                by_dataset.setdefault(name, []).append(fn)
+            # before anything reloads, so that nothing reads the old file
+            for module, attribute in _FILE_LAZIES.get(fn, ()):
+                invalidate(getattr(module, attribute))
+
+        changes = []
+        for name, fns in sorted(by_dataset.iteritems()):
+            module, attribute = _LAZIES[name]
+            lazy = getattr(module, attribute)
+            if name in ('provinces', 'countries', 'national_ideas'):
+                fns = [fn for fn in fns if name != 'national_ideas' or
+                       self._is_national_ideas(fn)]
+                entries = [e for fn in fns for e in self._entries(name, fn)]
+                changes.extend((name, k, v) for k, v in entries)
+                if loaded(lazy) and isinstance(resolve(lazy), dict):
+                    data = resolve(lazy)
+                    for k, v in entries:
+                        if v is None:
+                            data.pop(k, None)
+                        else:
+                            data[k] = v
+                else:
+                    invalidate(lazy)
+            else:
+                changes.append((name, None, None))
+                invalidate(lazy)
+            for module, attribute in _DEPENDENTS.get(name, ()):
+                invalidate(getattr(module, attribute))
+        return changes
+
+    def watch(self, interval=1.0):
+        """
+        Yields the changes of every poll that found any, polling every
+        interval seconds.
+        """
+        while True:
+            changes = self.poll()
+            if changes:
+                yield changes
+            time.sleep(interval)
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(
+        description="Prints changes to the game files as they are made.")
+    p.add_argument('--interval', '-i', type=float, default=1.0,
+                   help="seconds between polls")
+    options = p.parse_args()
+
+    try:
+        for changes in Watcher().watch(options.interval):
+            for name, key, value in changes:
+                print name, 'reloads' if key is None else key
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+from time import time
+
+__all__ = ['Lazy', 'resolve', 'loaded', 'invalidate', 'timings']
+
+# (description, seconds) for every value loaded so far, in load order; times
+# include loading any other lazy values the loader needed
+timings = []
+
+_MISSING = object()
+
+
+def _identity(value):
+    return value
+
+
+def resolve(value):
+    """
+    Returns the value a Lazy stands in for, loading it if needed, or value
+    itself if it is not a Lazy.
+    """
+    return value._get() if isinstance(value, Lazy) else value
+
+
+def loaded(lazy):
+    """
+    Returns whether a Lazy has loaded its value yet.
+    """
+    return lazy._value is not _MISSING
+
+
+def invalidate(lazy):
+    """
+    Forgets the value of a Lazy so that it loads again on next use.
+    """
+    lazy._value = _MISSING
+
+
+class Lazy(object):
+    """
+    Stands in for loader(*args), which is only called the first time the value
+    is used. Lazy arguments are resolved before being passed to loader.
+    """
+    __slots__ = ('_loader', '_args', '_value')
+
+    def __init__(self, loader, *args):
+        self._loader = loader
+        self._args = args
+        self._value = _MISSING
+
+    def _get(self):
+        if self._value is _MISSING:
+            args = tuple(resolve(arg) for arg in self._args)
+            start = time()
+            self._value = self._loader(*args)
+            timings.append((self._describe(), time() - start))
+        return self._value
+
+    def _describe(self):
+        name = '%s.%s' % (self._loader.__module__, self._loader.__name__)
+        if self._args and not any(isinstance(a, Lazy) for a in self._args):
+            name += repr(self._args)
+        return name
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __setitem__(self, key, value):
+        self._get()[key] = value
+
+    def __contains__(self, key):
+        return key in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+    def __nonzero__(self):
+        return bool(self._get())
+
+    def __eq__(self, other):
+        return self._get() == other
+
+    def __ne__(self, other):
+        return self._get() != other
+
+    def __repr__(self):
+        return repr(self._get())
+
+    def __str__(self):
+        return str(self._get())
+
+    def __reduce__(self):
+        # pickles as the value itself
+        return (_identity, (self._get(),))
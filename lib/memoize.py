@@ -1,22 +1,148 @@
 from functools import wraps
+from glob import glob
+from hashlib import sha1
+from os.path import expanduser, join
+from types import CodeType
 import cPickle
+import errno
+import marshal
+import os
+import tempfile
 
-def pickled(func):
-    fn = func.func_name + '.pickle'
+__all__ = ['pickled', 'input_stats', 'cache_dir', 'max_cache_size']
+
+# both may be changed at runtime, they are looked up on every call
+cache_dir = os.environ.get('VEU_CACHE_DIR', expanduser('~/.cache/veu'))
+max_cache_size = 512 << 20
+
+_SUFFIX = '.pickle'
+
+
+def _fingerprint(obj):
+    """
+    Reduces obj to nested tuples that pickle the same way whenever obj
+    compares equal, regardless of dict ordering.
+    """
+    if isinstance(obj, dict):
+        items = [(_fingerprint(k), _fingerprint(v)) for k, v in obj.iteritems()]
+        if type(obj) is dict:
+            items.sort()
+        return (type(obj).__name__, tuple(items))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(_fingerprint(v) for v in obj))
+    if isinstance(obj, (set, frozenset)):
+        return ('set', tuple(sorted(_fingerprint(v) for v in obj)))
+    return obj
+
+
+def input_stats(inputs):
+    """
+    Returns (filename, size, mtime) for every file matched by the glob patterns
+    in inputs, or returned by inputs if it is callable.
+    """
+    if callable(inputs):
+        inputs = inputs()
+    stats = []
+    for pattern in inputs:
+        for fn in sorted(glob(pattern)):
+            st = os.stat(fn)
+            stats.append((fn, st.st_size, st.st_mtime))
+    return tuple(stats)
+
+
+def _code(code):
+    """
+    Reduces a code object to what it does, leaving out the file name and line
+    numbers, which depend on how the module was imported and where it sits.
+    """
+    consts = tuple(_code(c) if isinstance(c, CodeType) else c
+                   for c in code.co_consts)
+    return (code.co_code, consts, code.co_names)
+
+
+def _key(func, args, kw, inputs):
+    digest = sha1()
+    digest.update(func.__module__ + '.' + func.func_name)
+    digest.update(marshal.dumps(_code(func.func_code)))
+    digest.update(cPickle.dumps(
+        (_fingerprint(args), _fingerprint(kw), input_stats(inputs)),
+        cPickle.HIGHEST_PROTOCOL))
+    return digest.hexdigest()
+
+
+def _evict(directory, limit):
+    """
+    Removes least recently used cache files until at most limit bytes remain.
+    Hits touch their file, so mtime is the time of last use.
+    """
+    entries = []
+    total = 0
+    for fn in glob(join(directory, '*' + _SUFFIX)):
+        try:
+            st = os.stat(fn)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, fn))
+        total += st.st_size
+    entries.sort()
+    for mtime, size, fn in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(fn)
+        except OSError:
+            pass
+        total -= size
+
+
+def _store(fn, result):
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            cPickle.dump(result, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, fn)
+    except:
+        os.remove(tmp)
+        raise
+
+
+def pickled(func=None, inputs=()):
+    """
+    Caches results on disk in cache_dir, keyed on the function and its code,
+    its arguments and the size and mtime of every file matched by the glob
+    patterns in inputs (or returned by inputs, if it is callable). Can be used
+    bare or as @pickled(inputs=[...]).
+    """
+    if func is None:
+        return lambda func: pickled(func, inputs)
 
     @wraps(func)
     def wrapper(*args, **kw):
+        fn = join(cache_dir, '%s.%s%s' % (
+            func.func_name, _key(func, args, kw, inputs), _SUFFIX))
         try:
-            with open(fn, 'r') as f:
+            with open(fn, 'rb') as f:
                 result = cPickle.load(f)
-                return result
+            os.utime(fn, None)
+            return result
         except IOError as e:
-            if e.errno != 2:
+            if e.errno != errno.ENOENT:
                 raise
+        except Exception:
+            # truncated, or pickled from classes that have since changed
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
 
-            result = func(*args, **kw)
-            with open(fn, 'w') as f:
-                cPickle.dump(result, f)
-            return result
+        result = func(*args, **kw)
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        _store(fn, result)
+        _evict(cache_dir, max_cache_size)
+        return result
 
     return wrapper
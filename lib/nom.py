@@ -7,12 +7,28 @@
 # Creative Commons, 444 Castro Street, Suite 900, Mountain View,
 # California, 94041, USA.
 
-from collections import OrderedDict
+from collections import MutableMapping, OrderedDict, namedtuple
+from decimal import Decimal
+from fnmatch import translate
+from itertools import count, izip
+import mmap
+import re
+import sys
 
 import ply.lex as lex
 import ply.yacc as yacc
 
-__all__ = ['nom', 'PlyException']
+__all__ = [
+    'nom', 'nom_file', 'nom_pairs', 'iter_nom', 'build', 'iter_subtrees', 'split_blocks',
+    'PlyException', 'ENGINES', 'KEY', 'VALUE', 'START', 'END', 'Date', 'Node',
+    'HashCons', 'sharing',
+]
+
+# 'native' is the hand-written linear-time parser below, 'mapped' the same
+# parser over token spans of a str, mmap or buffer, and 'ply' the original
+# grammar; all produce identical output
+ENGINES = ('native', 'mapped', 'ply')
+DEFAULT_ENGINE = 'native'
 
 
 class PlyException(Exception):
@@ -134,8 +150,783 @@ def toDict(l):
     return d
 
 
-def nom(buf, debug=False):
-    return toDict(parser.parse(buf, debug=debug))
+# blocks with fewer keys than this are searched rather than indexed
+_INDEX_SIZE = 8
+
+
+# default of Node.pop when no default is given
+_MISSING = object()
+
+
+class Node(object):
+    """
+    A compact stand-in for the OrderedDict of a block: parallel tuples of keys
+    and values, plus a key index built on first lookup in large blocks. Has
+    the dict API, including the rarer changes, which copy the tuples.
+    """
+    __slots__ = ('_keys', '_values', '_index')
+
+    def __init__(self, keys=(), values=()):
+        self._keys = tuple(keys)
+        self._values = tuple(values)
+        self._index = None
+
+    def _find(self, key):
+        keys = self._keys
+        if len(keys) < _INDEX_SIZE:
+            try:
+                return keys.index(key)
+            except ValueError:
+                return -1
+        if self._index is None:
+            self._index = dict(izip(keys, count()))
+        return self._index.get(key, -1)
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._values[i]
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        return default if i < 0 else self._values[i]
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return izip(self._keys, self._values)
+
+    def __setitem__(self, key, value):
+        i = self._find(key)
+        if i < 0:
+            self._keys += (key,)
+            self._values += (value,)
+            self._index = None
+        else:
+            self._values = self._values[:i] + (value,) + self._values[i + 1:]
+
+    def __delitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        self._keys = self._keys[:i] + self._keys[i + 1:]
+        self._values = self._values[:i] + self._values[i + 1:]
+        self._index = None
+
+    def pop(self, key, default=_MISSING):
+        i = self._find(key)
+        if i < 0:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        value = self._values[i]
+        del self[key]
+        return value
+
+    popitem = MutableMapping.popitem.im_func
+    setdefault = MutableMapping.setdefault.im_func
+    update = MutableMapping.update.im_func
+    clear = MutableMapping.clear.im_func
+
+    def copy(self):
+        return Node(self._keys, self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Node):
+            return self._keys == other._keys and self._values == other._values
+        if isinstance(other, OrderedDict):
+            return self.items() == other.items()
+        if isinstance(other, dict):
+            return dict(self.iteritems()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (Node, (self._keys, self._values))
+
+    def __repr__(self):
+        return 'Node(%r)' % (self.items(),)
+
+MutableMapping.register(Node)
+
+
+def toNode(l):
+    """
+    toDict() into a Node.
+    """
+    keys = []
+    values = []
+    positions = {}
+    for key, value in l:
+        i = positions.get(key)
+        if i is None and not key.startswith('add_') and not key.startswith('remove_'):
+            positions[key] = len(keys)
+            keys.append(key)
+            values.append(value)
+        elif i is None:
+            positions[key] = len(keys)
+            keys.append(key)
+            values.append([value])
+        else:
+            try:
+                values[i].append(value)
+            except AttributeError:
+                values[i] = [values[i], value]
+    return Node(keys, values)
+
+
+# (name, stats) of every finished HashCons, in the order they finished
+sharing = []
+
+
+def _size(value):
+    if isinstance(value, Node):
+        return (sys.getsizeof(value) + sys.getsizeof(value._keys) +
+                sys.getsizeof(value._values))
+    return sys.getsizeof(value)
+
+
+class HashCons(object):
+    """
+    Stores structurally equal subtrees once: cons() returns the first block or
+    tuple of values equal to the one given, whose own subtrees must have been
+    through cons() already, and interns strings. Nodes also share their tuples
+    of keys. Shared blocks must not be changed.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._table = {}
+        self._keys = {}
+        self.subtrees = 0
+        self.shared = 0
+        self.saved = 0
+
+    def _part(self, value):
+        t = type(value)
+        if t is str:
+            return value
+        if t is list:
+            return (list, tuple([self._part(v) for v in value]))
+        if t in (Node, OrderedDict, dict, tuple):
+            # already shared, so equal means identical
+            return id(value)
+        if t is Decimal:
+            return (t, str(value))
+        return (t, value)
+
+    def cons(self, value):
+        t = type(value)
+        if t is str:
+            return intern(value)
+        if t is Node:
+            keys = self._keys.setdefault(value._keys, value._keys)
+            key = (t, keys, tuple([self._part(v) for v in value._values]))
+        elif t is tuple:
+            key = (t, tuple([self._part(v) for v in value]))
+        elif t is OrderedDict or t is dict:
+            key = (t, tuple(value), tuple([self._part(v) for v in value.itervalues()]))
+        else:
+            return value
+        try:
+            existing = self._table[key]
+        except KeyError:
+            self.subtrees += 1
+            if t is Node:
+                value._keys = keys
+            self._table[key] = value
+            return value
+        if existing is value:
+            # seen again, e.g. by a second share() of the same tree
+            return value
+        self.subtrees += 1
+        self.shared += 1
+        self.saved += _size(value)
+        return existing
+
+    def share(self, tree):
+        """
+        Replaces every subtree below tree, but not tree itself, by the one
+        cons() returns for it, and returns tree.
+        """
+        t = type(tree)
+        if t is Node:
+            tree._values = tuple([self.cons(self.share(v)) for v in tree._values])
+        elif t is OrderedDict or t is dict:
+            for k, v in tree.iteritems():
+                # setting existing keys keeps their order
+                tree[k] = self.cons(self.share(v))
+        elif t is list:
+            tree[:] = [self.cons(self.share(v)) for v in tree]
+        elif t is tuple:
+            tree = tuple([self.cons(self.share(v)) for v in tree])
+        return tree
+
+    def stats(self):
+        """
+        Returns an OrderedDict of the number of subtrees seen, how many of
+        them were replaced by an equal one, how many are left and roughly how
+        many bytes that saved.
+        """
+        return OrderedDict([
+            ('subtrees', self.subtrees), ('shared', self.shared),
+            ('unique', len(self._table)), ('saved', self.saved)])
+
+    def finish(self):
+        """
+        Adds the stats to sharing and drops the table; what was shared stays
+        shared.
+        """
+        sharing.append((self.name, self.stats()))
+        self._table = {}
+        self._keys = {}
+
+
+# same token rules as the PLY lexer above; comments match with empty groups
+_QUOTED = r'\"[^\"]+\"'
+_BARE = r'[^ \t\r\n\{\}\=\#]+'
+_token_re = re.compile(r'\#[^\n]*|([{}=]|%s|%s)' % (_QUOTED, _BARE))
+# bare items get their own group so that unterminated quotes can be spotted
+_chunk_token_re = re.compile(r'\#[^\n]*|([{}=]|%s)|(%s)' % (_QUOTED, _BARE))
+
+# a run of anything but curly braces, or a single curly brace; quoted items
+# are tried before bare ones, like the lexer does
+_scan_re = re.compile(r'(?:\s+|%s|[^\s{}=\#]+|=|\#[^\n]*)+|([{}])' % _QUOTED)
+
+# the token rules again with a group per kind
+_span_re = re.compile(r'\#[^\n]*|(%s|%s)|(=)|([{}])' % (_QUOTED, _BARE))
+
+# values told apart by typed parsing: ints, fixed-point decimals and dates
+_typed_re = re.compile(r'(-?\d+)$|(-?\d*\.\d+)$|(\d+)\.(\d+)\.(\d+)$')
+
+_magic_re = re.compile(r'[*?[]')
+
+KEY, VALUE, START, END = 'key', 'value', 'start', 'end'
+_EOF = (None, None)
+
+CHUNK_SIZE = 1 << 16
+
+
+def _tokens(buf):
+    return [token for token in _token_re.findall(buf) if token]
+
+
+def _iter_tokens(f, chunk_size=CHUNK_SIZE):
+    """
+    Tokenizes anything with a read() method chunk_size bytes at a time. A
+    token touching the end of the chunk, or a quote that may be closed in a
+    later chunk, is carried over into the next one.
+    """
+    buf = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        buf += chunk
+        end = len(buf)
+        for m in _chunk_token_re.finditer(buf):
+            bare = m.group(2)
+            if m.end() == end or (
+                    bare and bare[0] == '"' and bare[1:2] != '"'):
+                end = m.start()
+                break
+            token = m.group(1) or bare
+            if token:
+                yield token
+        buf = buf[end:]
+    for token in _tokens(buf):
+        yield token
+
+
+def _events(tokens):
+    """
+    Turns tokens into (kind, data) events, folding 'ITEM =' into a single KEY.
+    """
+    pending = None
+    for token in tokens:
+        if token == '=':
+            if pending is None:
+                raise PlyException("Error parsing '%s'." % token)
+            yield KEY, pending
+            pending = None
+            continue
+        if pending is not None:
+            yield VALUE, pending
+            pending = None
+        if token == '{':
+            yield START, None
+        elif token == '}':
+            yield END, None
+        else:
+            pending = token
+    if pending is not None:
+        yield VALUE, pending
+
+
+def _span_events(buf):
+    """
+    Like _events(_tokens(buf)) for anything re can scan, without building a
+    list of tokens. Keys are sliced out of buf and interned; values are left
+    as the matches of their spans for the builder to slice out if it keeps
+    them.
+    """
+    pending = None
+    for m in _span_re.finditer(buf):
+        group = m.lastindex
+        if group == 1:
+            if pending is not None:
+                yield VALUE, pending
+            pending = m
+        elif group == 2:
+            if pending is None:
+                raise PlyException("Error parsing '='.")
+            yield KEY, intern(pending.group())
+            pending = None
+        elif group == 3:
+            if pending is not None:
+                yield VALUE, pending
+                pending = None
+            yield (START if m.group() == '{' else END), None
+    if pending is not None:
+        yield VALUE, pending
+
+
+Date = namedtuple('Date', 'year month day')
+
+
+def _typed(token):
+    m = _typed_re.match(token)
+    if m is None:
+        if token == 'yes':
+            return True
+        if token == 'no':
+            return False
+        return intern(token)
+    if m.group(1):
+        return int(token)
+    if m.group(2):
+        return Decimal(token)
+    return Date(*[int(part) for part in m.group(3, 4, 5)])
+
+
+def _typer(text=None):
+    """
+    Returns a function converting VALUE data, or what text makes of it, with
+    _typed(). Every token is converted once per parse, so equal values share
+    one object.
+    """
+    cache = {}
+
+    def typed(data):
+        token = data if text is None else text(data)
+        try:
+            return cache[token]
+        except KeyError:
+            value = cache[token] = _typed(token)
+            return value
+    return typed
+
+
+def _compile_select(select):
+    """
+    Turns key paths, given as sequences of keys or as '/'-separated strings,
+    into tuples of matchers. Keys may be fnmatch-style patterns.
+    """
+    if select is None:
+        return None
+    compiled = []
+    for path in select:
+        if isinstance(path, basestring):
+            path = [key for key in path.split('/') if key]
+        if not path:
+            return None
+        compiled.append(tuple(
+            re.compile(translate(key)).match if _magic_re.search(key)
+            else key.__eq__
+            for key in path))
+    return compiled
+
+
+def _narrow(select, key):
+    """
+    Returns the remainder of select below key: None if everything below key is
+    wanted and an empty list if nothing is.
+    """
+    narrowed = []
+    for path in select:
+        if path[0](key):
+            if len(path) == 1:
+                return None
+            narrowed.append(path[1:])
+    return narrowed
+
+
+class _Builder(object):
+    """
+    Recursive descent equivalent of the PLY grammar, including the way its
+    conflicts are resolved: 'value { keyvalues }' inside a list of values turns
+    the whole block into keyvalues, with the inner block left as a raw list of
+    pairs.
+
+    select is threaded through as the compiled key paths still to be matched;
+    values of keys outside of it are skipped without being built.
+
+    If text is given, VALUE data is passed through it when a value is kept,
+    e.g. to slice spans out of a buffer. Blocks are built with toDict, or with
+    toNode if compact is set. Values and blocks go through share, a HashCons,
+    if given.
+    """
+
+    def __init__(self, events, text=None, compact=False, share=None):
+        events = iter(events)
+        self._next = lambda: next(events, _EOF)
+        if text is not None:
+            self._text = text
+        self._dict = toNode if compact else toDict
+        if share is not None:
+            text = self._text
+            self._text = lambda data: share.cons(text(data))
+            self._cons = share.cons
+
+    @staticmethod
+    def _cons(value):
+        return value
+
+    @staticmethod
+    def _text(data):
+        return data
+
+    def _error(self, data):
+        if data is not None and not isinstance(data, basestring):
+            # a match from _span_events
+            data = data.group()
+        raise PlyException("Error parsing '%s'." % (data,))
+
+    def result(self, select=None):
+        """
+        Returns the top-level (key, value) pairs, before toDict.
+        """
+        pairs = []
+        kind, data = self._next()
+        while kind is not None:
+            self._pair(pairs, kind, data, select)
+            kind, data = self._next()
+        return pairs
+
+    def _skip(self):
+        # only balances curly braces, so syntax errors inside go unnoticed
+        kind, data = self._next()
+        if kind == VALUE:
+            return
+        if kind != START:
+            self._error(data)
+        self._skip_block()
+
+    def _skip_block(self):
+        depth = 1
+        while depth:
+            kind, data = self._next()
+            if kind == START:
+                depth += 1
+            elif kind == END:
+                depth -= 1
+            elif kind is None:
+                self._error(data)
+
+    @staticmethod
+    def _key(data):
+        # a VALUE used as a key is left as it is, like any other key
+        return data if isinstance(data, basestring) else intern(data.group())
+
+    def _value(self, kind, data, select=None):
+        if kind == VALUE:
+            return self._text(data)
+        if kind == START:
+            return self._block(False, select)[1]
+        self._error(data)
+
+    def _pair(self, pairs, kind, data, select):
+        if kind == KEY:
+            if select is not None:
+                select = _narrow(select, data)
+                if select is not None and not select:
+                    self._skip()
+                    return
+            value = self._value(*self._next(), select=select)
+            # partially selected keys are only worth keeping for their blocks
+            if select is None or (isinstance(value, (dict, Node)) and value):
+                pairs.append((data, value))
+            return
+        if kind == VALUE:
+            key = self._key(data)
+            if select is not None:
+                select = _narrow(select, key)
+                if select is not None and not select:
+                    kind, data = self._next()
+                    if kind != START:
+                        self._error(data)
+                    self._skip_block()
+                    return
+        else:
+            key = self._value(kind, data, select)
+        kind, data = self._next()
+        if kind != START:
+            self._error(data)
+        kind, data = self._next()
+        if kind == END:
+            self._error(data)
+        inner = []
+        self._pair(inner, kind, data, select)
+        inner = self._pairs(inner, True, select)
+        if select is None or inner:
+            pairs.append((key, inner))
+
+    def _pairs(self, pairs, raw, select):
+        kind, data = self._next()
+        while kind != END:
+            self._pair(pairs, kind, data, select)
+            kind, data = self._next()
+        return pairs if raw else self._cons(self._dict(pairs))
+
+    def _block(self, raw, select):
+        """
+        Parses the contents of a block after its opening curly brace and
+        returns (is_keyvalues, value). With raw set keyvalues are returned as
+        a list of pairs rather than a dictionary.
+        """
+        kind, data = self._next()
+        if kind == END:
+            return False, None
+        if kind == KEY:
+            pairs = []
+            self._pair(pairs, kind, data, select)
+            return True, self._pairs(pairs, raw, select)
+
+        # in case first turns out to be the key of 'value { keyvalues }'
+        first_kind, first_data = kind, data
+        inner_select = select
+        if kind == VALUE and select is not None:
+            inner_select = _narrow(select, self._key(data))
+        first = self._value(kind, data, select)
+        kind, data = self._next()
+        if kind == END:
+            return False, self._cons((first,))
+        if kind == VALUE:
+            values = [first, self._text(data)]
+        elif kind == START:
+            is_keyvalues, value = self._block(True, inner_select)
+            if is_keyvalues:
+                if first_kind == VALUE:
+                    first = self._key(first_data)
+                pairs = [(first, value)] if select is None or value else []
+                return True, self._pairs(pairs, raw, select)
+            values = [first, value]
+        else:
+            self._error(data)
+
+        kind, data = self._next()
+        while kind != END:
+            values.append(self._value(kind, data, select))
+            kind, data = self._next()
+        return False, self._cons(tuple(values))
+
+
+def nom(buf, debug=False, engine=None, select=None, typed=False,
+        compact=False, share=None):
+    """
+    Parses buf. If select is given, only keys on the given key paths (and
+    whatever is below them) are kept, e.g. ('owner', '*/owner') keeps the
+    top-level owner and the owner in every dated block.
+
+    With typed set values are converted as they are parsed: integers to int,
+    numbers with a fraction to Decimal, dates such as 1444.11.11 to Date, yes
+    and no to True and False. Other values are interned strings. Keys are left
+    as they are.
+
+    With compact set blocks are Nodes rather than OrderedDicts. Given a
+    HashCons as share, equal values and blocks below the top level are stored
+    once.
+    """
+    engine = engine or DEFAULT_ENGINE
+    if engine == 'ply':
+        if select is not None or typed or compact or share is not None:
+            raise ValueError("The ply engine does not support select, typed, "
+                             "compact or share.")
+        return toDict(parser.parse(buf, debug=debug))
+    if engine not in ('native', 'mapped'):
+        raise ValueError("Unknown engine '%s'." % engine)
+    pairs = nom_pairs(buf, select, engine, typed, compact, share)
+    return toNode(pairs) if compact else toDict(pairs)
+
+
+def _match_text(m):
+    return m.group()
+
+
+def nom_pairs(buf, select=None, engine=None, typed=False, compact=False,
+              share=None):
+    """
+    Parses buf with the native or mapped engine into a list of its top-level
+    (key, value) pairs. toDict(), or toNode() if compact is set, of the pairs
+    of consecutive pieces of a file is the nom() of the whole file.
+    """
+    select = _compile_select(select)
+    if engine == 'mapped' or not isinstance(buf, str):
+        events = _span_events(buf)
+        text = _typer(_match_text) if typed else _match_text
+    else:
+        events = _events(_tokens(buf))
+        text = _typer() if typed else None
+    return _Builder(events, text, compact, share).result(select)
+
+
+def nom_file(filename, select=None, engine=None, typed=False, compact=False,
+             share=None):
+    """
+    Parses the file filename. The mapped engine, the default, parses it in
+    place through mmap rather than reading it into a string first.
+    """
+    engine = engine or 'mapped'
+    with open(filename, 'rb') as f:
+        if engine != 'mapped':
+            return nom(f.read(), engine=engine, select=select, typed=typed,
+                       compact=compact, share=share)
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return nom('', select=select, compact=compact)
+    try:
+        return nom(buf, select=select, engine=engine, typed=typed,
+                   compact=compact, share=share)
+    finally:
+        buf.close()
+
+
+def split_blocks(buf, parts):
+    """
+    Returns up to parts - 1 offsets that cut buf into pieces of roughly equal
+    size, each one just after the closing curly brace of a top-level
+    'key = { ... }'. Quoted items and comments are skipped the way the lexer
+    skips them; unbalanced braces only make for fewer or odd cuts.
+    """
+    offsets = []
+    if parts <= 1:
+        return offsets
+    step = len(buf) // parts
+    target = step
+    depth = 0
+    keyed = False
+    previous = None
+    for m in _scan_re.finditer(buf):
+        brace = m.group(1)
+        if brace == '{':
+            if not depth:
+                tokens = _tokens(previous.group()) if previous else ()
+                keyed = bool(tokens) and tokens[-1] == '='
+            depth += 1
+        elif brace == '}':
+            depth -= 1
+            if not depth and keyed and m.end() >= target:
+                offsets.append(m.end())
+                if len(offsets) == parts - 1:
+                    break
+                target = m.end() + step
+        previous = None if brace else m
+    return offsets
+
+
+def iter_nom(f, chunk_size=CHUNK_SIZE):
+    """
+    Yields (kind, data) events for a file object or mmap, reading it in
+    chunk_size pieces. kind is one of KEY, VALUE, START and END; data is the
+    key or value and None for START and END.
+    """
+    return _events(_iter_tokens(f, chunk_size))
+
+
+def build(events, value=False, select=None):
+    """
+    Builds nom() output from events. If value is set only the next value is
+    consumed and returned, as when called right after a KEY event.
+    """
+    builder = _Builder(events)
+    select = _compile_select(select)
+    if value:
+        return builder._value(*builder._next(), select=select)
+    return toDict(builder.result(select))
+
+
+def iter_subtrees(events, path):
+    """
+    Yields the value of every key at path, a sequence of keys starting at the
+    top level, building only those values and skipping everything else.
+    """
+    events = iter(events)
+    if not path:
+        yield build(events)
+        return
+    prefix, last = list(path[:-1]), path[-1]
+    stack = []
+    key = None
+    for kind, data in events:
+        if kind == KEY:
+            if data == last and stack == prefix:
+                yield build(events, True)
+                continue
+            key = data
+        elif kind == START:
+            stack.append(key)
+            key = None
+        elif kind == END:
+            if not stack:
+                raise PlyException("Error parsing '}'.")
+            stack.pop()
+        else:
+            key = None
+
+
+def compare_engines(buf):
+    """
+    Parses buf with every engine and returns True if they all agree. Parse
+    errors count as agreement as long as every engine fails.
+    """
+    results = []
+    for engine in ENGINES:
+        try:
+            results.append(nom(buf, engine=engine))
+        except Exception as e:
+            results.append(type(e))
+    return all(result == results[0] for result in results[1:])
 
 def main():
     import argparse
@@ -148,13 +939,59 @@ def main():
         '--silent', '-s', action='store_true', help="do not print nom output")
     p.add_argument(
         '--verbose', '-v', action='store_true', help="be more verbose")
+    p.add_argument(
+        '--engine', '-e', choices=ENGINES, default=DEFAULT_ENGINE,
+        help="parser engine to use")
+    p.add_argument(
+        '--compare', '-c', action='store_true',
+        help="check that all engines produce the same output")
+    p.add_argument(
+        '--path', '-p',
+        help="stream the file and print only values at this /-separated path")
+    p.add_argument(
+        '--typed', '-t', action='store_true',
+        help="convert numbers, dates and yes/no values")
+    p.add_argument(
+        '--compact', action='store_true', help="build blocks as Nodes")
+    p.add_argument(
+        '--share', action='store_true',
+        help="store equal subtrees once and print how many were")
+    p.add_argument(
+        '--workers', '-w', type=int,
+        help="parse pieces of the file in this many processes")
     options = p.parse_args()
     if options.verbose:
         print options.file[0]
     with open(options.file[0], 'rb') as f:
+        if options.path is not None:
+            path = [key for key in options.path.split('/') if key]
+            try:
+                for result in iter_subtrees(iter_nom(f), path):
+                    if not options.silent:
+                        print result
+            except PlyException as e:
+                print str(e)
+            return
         buf = f.read()
+        if options.compare:
+            print 'engines agree' if compare_engines(buf) else 'engines differ'
+            return
         try:
-            result = nom(buf, True if options.debug else False)
+            share = HashCons(options.file[0]) if options.share else None
+            if options.workers is not None:
+                from lib.pool import nom_parallel
+                result = nom_parallel(
+                    buf, workers=options.workers, typed=options.typed,
+                    compact=options.compact)
+                if share is not None:
+                    share.share(result)
+            else:
+                result = nom(buf, True if options.debug else False,
+                             options.engine, typed=options.typed,
+                             compact=options.compact, share=share)
+            if share is not None:
+                for k, v in share.stats().iteritems():
+                    print >> sys.stderr, k, v
             if not options.silent:
                 print result
         except PlyException as e:
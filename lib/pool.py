@@ -0,0 +1,75 @@
+from multiprocessing import Pool, cpu_count
+
+from lib.nom import nom, nom_file, nom_pairs, split_blocks, toDict, toNode
+
+__all__ = ['nom_files', 'nom_parallel']
+
+
+def _nom_file(args):
+    fn, select, typed, compact = args
+    return nom_file(fn, select, typed=typed, compact=compact)
+
+
+def _nom_chunk(args):
+    buf, select, typed, compact = args
+    return nom_pairs(buf, select, typed=typed, compact=compact)
+
+
+def nom_files(filenames, select=None, workers=None, typed=False,
+              compact=False, share=None):
+    """
+    Parses every file in filenames, spreading them over a pool of workers
+    processes (all cores by default), and returns a list of (filename, result)
+    pairs in the order the files were given. select, typed and compact are
+    passed on to nom(). share, a HashCons, is applied to every result in this
+    process, so that subtrees are shared across files.
+    """
+    filenames = list(filenames)
+    if workers is None:
+        workers = cpu_count()
+    workers = min(workers, len(filenames))
+    jobs = [(fn, select, typed, compact) for fn in filenames]
+
+    if workers <= 1:
+        return [(fn, nom_file(fn, select, typed=typed, compact=compact,
+                              share=share))
+                for fn in filenames]
+
+    pool = Pool(workers)
+    try:
+        results = pool.map(
+            _nom_file, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+    finally:
+        pool.close()
+        pool.join()
+    if share is not None:
+        results = [share.share(result) for result in results]
+    return zip(filenames, results)
+
+
+def nom_parallel(buf, select=None, workers=None, typed=False,
+                 compact=False):
+    """
+    Parses a single large buf, such as a save, by cutting it at top-level
+    blocks (see split_blocks) and parsing the pieces in a pool of workers
+    processes (all cores by default). The result is the same as nom(buf,
+    select=select, typed=typed, compact=compact).
+    """
+    if workers is None:
+        workers = cpu_count()
+    # a few pieces per worker so that one large block does not hold up the rest
+    offsets = split_blocks(buf, workers * 4 if workers > 1 else 1)
+    if not offsets:
+        return nom(buf, select=select, typed=typed, compact=compact)
+    bounds = zip([0] + offsets, offsets + [len(buf)])
+    jobs = [(buf[start:end], select, typed, compact)
+            for start, end in bounds]
+
+    pool = Pool(min(workers, len(jobs)))
+    try:
+        results = pool.map(_nom_chunk, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    pairs = [pair for pairs in results for pair in pairs]
+    return toNode(pairs) if compact else toDict(pairs)
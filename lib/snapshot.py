@@ -0,0 +1,316 @@
+from collections import Mapping, OrderedDict, Sequence
+from decimal import Decimal
+import mmap
+import os
+import struct
+import tempfile
+
+__all__ = [ 'Snapshot', 'MappedDict', 'MappedList', 'write_snapshot' ]
+
+# A snapshot file is a header, records and a string table:
+#
+# header   magic, offset of the string table, offset of the root record
+# record   kind, count, then for dicts a column of key types and a column of
+#          key payloads, then a column of value types and one of value
+#          payloads; types are bytes, payloads int64s padded to 8 bytes
+# strings  count, count + 1 end offsets, then the bytes of every string
+#
+# A payload is the value of an int, the bits of a float, the index of a
+# string or the offset of a nested record, depending on its type.
+
+_MAGIC = 'VEUSNAP1'
+_HEADER = struct.Struct('<8sQQ')
+_RECORD = struct.Struct('<cxxxI')
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, UNICODE, DECIMAL, BIGINT, RECORD = range(10)
+
+_DICT, _ORDERED_DICT, _LIST, _TUPLE = 'd', 'o', 'l', 't'
+_INT64 = (-1 << 63, (1 << 63) - 1)
+
+def _padded(n):
+    return (n + 7) & ~7
+
+class _Writer(object):
+    def __init__(self):
+        self.buf = bytearray(_HEADER.size)
+        self.strings = {}
+        # id: (value, offset) of every record written; shared subtrees are
+        # written once, and keeping value alive keeps its id from being reused
+        self.records = {}
+
+    def string(self, s):
+        try:
+            return self.strings[s]
+        except KeyError:
+            self.strings[s] = len(self.strings)
+            return self.strings[s]
+
+    def cell(self, value):
+        if value is None:
+            return NONE, 0
+        if value is True or value is False:
+            return (TRUE if value else FALSE), 0
+        if isinstance(value, (int, long)):
+            if _INT64[0] <= value <= _INT64[1]:
+                return INT, value
+            return BIGINT, self.string(str(value))
+        if isinstance(value, float):
+            return FLOAT, struct.unpack('<q', struct.pack('<d', value))[0]
+        if isinstance(value, str):
+            return STR, self.string(value)
+        if isinstance(value, unicode):
+            return UNICODE, self.string(value.encode('utf-8'))
+        if isinstance(value, Decimal):
+            return DECIMAL, self.string(str(value))
+        if isinstance(value, (Mapping, list, tuple)):
+            return RECORD, self.record(value)
+        raise TypeError("cannot snapshot %r" % (value,))
+
+    def record(self, value):
+        try:
+            return self.records[id(value)][1]
+        except KeyError:
+            pass
+        # nested records are written first so their offsets are known
+        if isinstance(value, Mapping):
+            # other mappings, such as lib.nom.Node, keep their order
+            kind = _DICT if type(value) is dict else _ORDERED_DICT
+            items = value.items()
+            columns = [
+                [self.cell(k) for k, v in items],
+                [self.cell(v) for k, v in items]]
+        else:
+            kind = _TUPLE if isinstance(value, tuple) else _LIST
+            columns = [[self.cell(v) for v in value]]
+
+        self.buf += '\0' * (_padded(len(self.buf)) - len(self.buf))
+        offset = len(self.buf)
+        self.buf += _RECORD.pack(kind, len(value))
+        for cells in columns:
+            types = bytearray(t for t, payload in cells)
+            self.buf += types + '\0' * (_padded(len(types)) - len(types))
+            self.buf += struct.pack(
+                '<%dq' % len(cells), *[payload for t, payload in cells])
+        self.records[id(value)] = (value, offset)
+        return offset
+
+    def finish(self, root):
+        root_offset = self.record(root)
+        strings = sorted(self.strings, key=self.strings.get)
+        strings_offset = _padded(len(self.buf))
+        self.buf += '\0' * (strings_offset - len(self.buf))
+        self.buf += struct.pack('<Q', len(strings))
+        end = strings_offset + 8 * (len(strings) + 2)
+        ends = []
+        for s in strings:
+            end += len(s)
+            ends.append(end)
+        self.buf += struct.pack('<%dQ' % (len(strings) + 1),
+                                strings_offset + 8 * (len(strings) + 2), *ends)
+        for s in strings:
+            self.buf += s
+        _HEADER.pack_into(self.buf, 0, _MAGIC, strings_offset, root_offset)
+        return self.buf
+
+def write_snapshot(path, root):
+    """
+    Writes root, a dict whose values may nest mappings, lists, tuples, strings,
+    numbers, Decimals, booleans and None, to path. Readers that have the old
+    file open keep seeing it.
+    """
+    data = _Writer().finish(root)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+class _Record(object):
+    """
+    Reads the columns of a record on first use.
+    """
+
+    def __init__(self, snapshot, offset):
+        self._snapshot = snapshot
+        self._offset = offset
+        self._columns = None
+        kind, self._len = _RECORD.unpack_from(snapshot.mmap, offset)
+
+    def _column(self, i):
+        if self._columns is None:
+            buf = self._snapshot.mmap
+            n = self._len
+            columns = []
+            offset = self._offset + _RECORD.size
+            for _ in xrange(2 if isinstance(self, MappedDict) else 1):
+                types = bytearray(buf[offset:offset + n])
+                offset += _padded(n)
+                payloads = struct.unpack_from('<%dq' % n, buf, offset)
+                offset += 8 * n
+                columns.append((types, payloads))
+            self._columns = columns
+        return self._columns[i]
+
+    def _values(self, column, lazy):
+        types, payloads = self._column(column)
+        decode = self._snapshot.decode
+        return [decode(t, p, lazy) for t, p in zip(types, payloads)]
+
+    def _value(self, column, i, lazy):
+        types, payloads = self._column(column)
+        return self._snapshot.decode(types[i], payloads[i], lazy)
+
+    def __len__(self):
+        return self._len
+
+class MappedDict(_Record, Mapping):
+    """
+    A read-only dict record of a Snapshot. Keys are decoded on first use;
+    values are decoded into plain dicts, lists and so on when they are looked
+    up, or kept as MappedDict and MappedList with lazy().
+    """
+
+    def __init__(self, snapshot, offset):
+        _Record.__init__(self, snapshot, offset)
+        self._keys = None
+        self._index = None
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = self._values(0, False)
+        return list(self._keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def _position(self, key):
+        if self._index is None:
+            self._index = dict((k, i) for i, k in enumerate(self.keys()))
+        return self._index[key]
+
+    def __contains__(self, key):
+        try:
+            self._position(key)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __getitem__(self, key):
+        return self._value(1, self._position(key), False)
+
+    def lazy(self, key):
+        return self._value(1, self._position(key), True)
+
+    def values(self):
+        return self._values(1, False)
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def iteritems(self):
+        for i, k in enumerate(self.keys()):
+            yield k, self._value(1, i, False)
+
+    def itervalues(self):
+        for i in xrange(self._len):
+            yield self._value(1, i, False)
+
+    def materialize(self):
+        kind = _RECORD.unpack_from(self._snapshot.mmap, self._offset)[0]
+        return (OrderedDict if kind == _ORDERED_DICT else dict)(self.items())
+
+    def __reduce__(self):
+        return (_identity, (self.materialize(),))
+
+    def __repr__(self):
+        return '<MappedDict of %d items>' % self._len
+
+class MappedList(_Record, Sequence):
+    """
+    A read-only list or tuple record of a Snapshot.
+    """
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.materialize()[i]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        return self._value(0, i, False)
+
+    def lazy(self, i):
+        return self._value(0, i, True)
+
+    def __iter__(self):
+        return iter(self._values(0, False))
+
+    def materialize(self):
+        kind = _RECORD.unpack_from(self._snapshot.mmap, self._offset)[0]
+        return (tuple if kind == _TUPLE else list)(self._values(0, False))
+
+    def __reduce__(self):
+        return (_identity, (self.materialize(),))
+
+    def __repr__(self):
+        return '<MappedList of %d items>' % self._len
+
+def _identity(value):
+    return value
+
+class Snapshot(object):
+    """
+    A snapshot file mapped into memory, so that processes reading the same
+    file share its pages. Nothing is decoded until it is used; root is the
+    MappedDict that was written.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._strings_offset, root_offset = _HEADER.unpack_from(
+            self.mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError("%s is not a snapshot" % path)
+        self._strings = {}
+        self.root = MappedDict(self, root_offset)
+
+    def close(self):
+        self.mmap.close()
+
+    def string(self, i):
+        try:
+            return self._strings[i]
+        except KeyError:
+            start, end = struct.unpack_from(
+                '<QQ', self.mmap, self._strings_offset + 8 * (i + 1))
+            s = self._strings[i] = self.mmap[start:end]
+            return s
+
+    def decode(self, t, payload, lazy=False):
+        if t == STR:
+            return self.string(payload)
+        if t == INT:
+            return payload
+        if t == RECORD:
+            kind = self.mmap[payload]
+            record = (MappedDict if kind in (_DICT, _ORDERED_DICT)
+                      else MappedList)(self, payload)
+            return record if lazy else record.materialize()
+        if t == NONE:
+            return None
+        if t in (TRUE, FALSE):
+            return t == TRUE
+        if t == FLOAT:
+            return struct.unpack('<d', struct.pack('<q', payload))[0]
+        if t == DECIMAL:
+            return Decimal(self.string(payload))
+        if t == UNICODE:
+            return self.string(payload).decode('utf-8')
+        if t == BIGINT:
+            return int(self.string(payload))
+        raise ValueError("unknown type %d" % t)
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib import memoize
+
+_SOURCE = '''
+def load(x):
+    def double(y):
+        return y * 2
+    return double(x) + 1
+'''
+
+
+def _compile(source, filename):
+    namespace = {'__name__': 'lib.test_load'}
+    exec compile(source, filename, 'exec') in namespace
+    return namespace['load']
+
+
+class KeyTest(unittest.TestCase):
+
+    def test_same_code_elsewhere(self):
+        a = _compile(_SOURCE, '/abs/eu4/terrain.py')
+        b = _compile('\n\n' + _SOURCE, 'eu4/terrain.py')
+        self.assertEqual(memoize._key(a, (1,), {}, ()),
+                         memoize._key(b, (1,), {}, ()))
+
+    def test_changed_code(self):
+        a = _compile(_SOURCE, 'eu4/terrain.py')
+        b = _compile(_SOURCE.replace('y * 2', 'y * 3'), 'eu4/terrain.py')
+        self.assertNotEqual(memoize._key(a, (1,), {}, ()),
+                            memoize._key(b, (1,), {}, ()))
+
+
+class PickledTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = memoize.cache_dir
+        memoize.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(memoize.cache_dir)
+        memoize.cache_dir = self.cache_dir
+
+    def test_corrupt_file_is_a_miss(self):
+        calls = []
+
+        @memoize.pickled
+        def load():
+            calls.append(1)
+            return [1, 2]
+
+        self.assertEqual(load(), [1, 2])
+        fn, = os.listdir(memoize.cache_dir)
+        fn = os.path.join(memoize.cache_dir, fn)
+        for data in ('', '\x80\x02c', '\x80\x02cno_such_module\nX\nq\x00.'):
+            with open(fn, 'wb') as f:
+                f.write(data)
+            self.assertEqual(load(), [1, 2])
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(load(), [1, 2])
+        self.assertEqual(len(calls), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from lib.nom import Node, nom
+
+
+class NodeTest(unittest.TestCase):
+
+    def test_pop(self):
+        node = Node(('a', 'b'), ('1', '2'))
+        self.assertEqual(node.pop('a'), '1')
+        self.assertEqual(node, Node(('b',), ('2',)))
+
+    def test_pop_missing_with_default(self):
+        node = Node(('a',), ('1',))
+        self.assertEqual(node.pop('capital', None), None)
+        self.assertEqual(node.pop('capital', '0'), '0')
+        self.assertEqual(node, Node(('a',), ('1',)))
+
+    def test_pop_missing(self):
+        node = Node(('a',), ('1',))
+        self.assertRaises(KeyError, node.pop, 'capital')
+
+
+class TypedTest(unittest.TestCase):
+
+    def test_keys_of_value_blocks_stay_text(self):
+        buf = '5 { 1 = 2 1444.1.1 = yes } c = { 7 { 8 = 9 } d = 1 }'
+        for engine in ('native', 'mapped'):
+            result = nom(buf, engine=engine, typed=True)
+            self.assertEqual(result.items(), [
+                ('5', [('1', 2), ('1444.1.1', True)]),
+                ('c', {'7': [('8', 9)], 'd': 1}),
+            ])
+
+
+if __name__ == '__main__':
+    unittest.main()
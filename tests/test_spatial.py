@@ -0,0 +1,31 @@
+import unittest
+
+import numpy
+
+from eu4.spatial import SpatialIndex
+
+
+class NearestTest(unittest.TestCase):
+
+    def setUp(self):
+        raster = numpy.zeros((100, 200), dtype=numpy.int64)
+        self.index = SpatialIndex(raster, [1, 2], [(10, 10), (190, 90)])
+
+    def test_on_map(self):
+        self.assertEqual(self.index.nearest(20, 5), 1)
+        self.assertEqual(self.index.nearest(150, 99), 2)
+
+    def test_off_map(self):
+        self.assertEqual(self.index.nearest(-1e6, 0), 1)
+        self.assertEqual(self.index.nearest(5000, 95), 2)
+        self.assertEqual(self.index.nearest(250, -3), 2)
+
+    def test_off_map_matches_batch(self):
+        xs = [-400, -20, 210, 800, 100, 100]
+        ys = [50, -300, 120, -5, -1, 100]
+        self.assertEqual([self.index.nearest(x, y) for x, y in zip(xs, ys)],
+                         list(self.index.nearest_batch(xs, ys)))
+
+
+if __name__ == '__main__':
+    unittest.main()